@@ -1,9 +1,14 @@
 import os
+import uuid
+from functools import partial
 import streamlit as st
-from google import genai
-from google.genai import types
-from PIL import Image
-import io
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from core import get_image_cache
+from jobs import JobQueueFull, get_job_queue
+from metrics import start_metrics_server
+from metrics_panel import render_metrics_panel
+from mindmap_renderer import THEME_PALETTES, render_png, render_svg
+from session_store import get_session_store
 
 # Setup Streamlit page
 st.set_page_config(
@@ -12,61 +17,92 @@ st.set_page_config(
     layout="centered"
 )
 
-# Initialize session state
+# Expose /metrics when BANANA_METRICS_PORT is set (once per process)
+start_metrics_server()
+
+# Initialize session state; images live in the session store, session_state only holds handles
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if 'generated_mindmap' not in st.session_state:
     st.session_state.generated_mindmap = None
+if 'job_id' not in st.session_state:
+    # The background job whose mind map this session shows, and the job file already pulled in
+    st.session_state.job_id = None
+    st.session_state.job_file = None
+    st.session_state.job_done = False
+    # Theme a locally rendered mind map was last redrawn in; None means the job's own theme
+    st.session_state.mindmap_theme = None
+if 'job_history' not in st.session_state:
+    st.session_state.job_history = []
 
-# Setup Client
-@st.cache_resource
-def get_client(api_key):
-    return genai.Client(api_key=api_key)
+session_store = get_session_store()
+session_store.touch(st.session_state.session_id)
+job_queue = get_job_queue()
+# The browser session of this run: its jobs are only cancelled as abandoned once it has been closed for a while
+session_owner = get_script_run_ctx().session_id
 
-MODEL_ID = "gemini-3-pro-image-preview"
+def keep_mindmap(mindmap):
+    """Spill the mind map to the session store, freeing the one it replaces"""
+    session_store.release(st.session_state.generated_mindmap)
+    st.session_state.generated_mindmap = session_store.put(st.session_state.session_id, mindmap) if mindmap else None
 
-def generate_mindmap(topic, api_key, theme, style, complexity, aspect_ratio="16:9", image_size="4K"):
-    # Build the prompt with customizations
-    prompt = f"""Create a detailed mind map about: {topic}
+def attach_job(job_id):
+    """Show job_id's mind map in this session, replacing the current one"""
+    keep_mindmap(None)
+    st.session_state.job_id = job_id
+    # A refreshed page is a new session; it takes over the job it reattached to
+    job_queue.claim(job_id, session_owner)
+    st.session_state.job_file = None
+    st.session_state.job_done = False
+    st.session_state.mindmap_theme = None
+    st.query_params["job"] = job_id
 
-Theme: {theme}
-Style: {style}
-Complexity: {complexity}
+def detach_job():
+    """Clear the mind map and stop its job if it is still rendering; the job stays in the sidebar"""
+    if st.session_state.job_id:
+        job_queue.cancel(st.session_state.job_id, "the mind map was closed")
+    keep_mindmap(None)
+    st.session_state.job_id = None
+    st.session_state.job_file = None
+    st.query_params.clear()
 
-Requirements:
-- Central concept in the middle
-- Main branches radiating outward with clear hierarchy
-- Sub-branches with related concepts
-- Use colors to differentiate categories
-- Include icons or small illustrations where relevant
-- Clean, organized layout with readable text
-- Professional and visually appealing design
-- Follow the {theme} color scheme
-- {style} visual style"""
+def sync_job(job):
+    """Pull the job's image into the session store if it changed since the last poll; True if it did"""
+    if job.files[0] is None or job.files[0] == st.session_state.job_file:
+        return False
+    mindmap = job.image(0)
+    if mindmap is None:
+        return False
+    keep_mindmap(mindmap)
+    st.session_state.job_file = job.files[0]
+    return True
 
-    try:
-        client = get_client(api_key)
-        # Call the API
-        response = client.models.generate_content(
-            model=MODEL_ID,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_modalities=["IMAGE"],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                    image_size=image_size
-                )
-            )
-        )
-        
-        # Handle the Image
-        for part in response.candidates[0].content.parts:
-            if part.inline_data:
-                image_data = part.inline_data.data
-                img = Image.open(io.BytesIO(image_data))
-                return img
-                
-    except Exception as e:
-        st.error(f"Error generating mind map: {e}")
-        return None
+@st.fragment(run_every=1)
+def watch_job():
+    """Poll the background job and swap in its mind map (draft, then full resolution) as it arrives"""
+    job = job_queue.get(st.session_state.job_id)
+    if job is None:
+        return
+    changed = sync_job(job)
+    if job.finished:
+        st.session_state.job_done = True
+        st.session_state.celebrate = job.status == "done"
+        st.rerun()
+    if changed:
+        st.rerun()
+    
+    if job.status == "queued":
+        st.caption("⏳ Waiting for a free worker...")
+    elif job.status == "running" and job.params.get("renderer") == "local":
+        st.info("🎨 Sketching the structure of your mind map... This takes a few seconds")
+    elif job.status == "running":
+        st.info("🎨 Creating your mind map... This may take 30-60 seconds")
+    else:
+        st.caption("⏳ Showing a fast draft while the full-resolution version renders in the background...")
+
+# Reattach to the job named in the URL, e.g. after a refresh or a dropped connection
+if st.query_params.get("job") and st.query_params.get("job") != st.session_state.job_id:
+    attach_job(st.query_params.get("job"))
 
 # Sidebar - API Key and Promotion
 with st.sidebar:
@@ -203,6 +239,14 @@ with st.form("mindmap_generation_form"):
     
     # Advanced options in expander
     with st.expander("⚙️ Advanced Options"):
+        renderer = st.radio(
+            "Renderer:",
+            ["Image model", "Local layout"],
+            horizontal=True,
+            help="The image model paints a detailed illustration. Local layout asks the text model for the structure "
+                 "and draws it here in under a second; it can be re-themed instantly and downloaded as SVG."
+        )
+        
         image_size = st.selectbox(
             "Image Quality:",
             ["2K", "4K"],
@@ -215,56 +259,152 @@ with st.form("mindmap_generation_form"):
             height=80,
             help="Add any specific requirements or preferences"
         )
+        
+        use_cache = st.checkbox(
+            "Reuse cached images",
+            value=True,
+            help="Serve identical requests from the local image cache. Uncheck to force a fresh render."
+        )
+        
+        fast_preview = st.checkbox(
+            "Fast preview",
+            value=False,
+            help="Show a quick 2K draft first, then swap in the full-quality render when it is ready"
+        )
+        cache_stats = get_image_cache().stats()
+        st.caption(
+            f"Image cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} images "
+            f"({cache_stats['bytes'] / 1024 / 1024:.1f} of {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB)"
+        )
     
     submitted = st.form_submit_button("🎨 Generate Mind Map", use_container_width=True)
 
-# Generate mind map when form is submitted
+# Queue the mind map as a background job; it keeps rendering across reruns, refreshes and disconnects
 if submitted and topic:
-    with st.spinner("Creating your mind map... This may take 30-60 seconds"):
-        # Add custom instructions to complexity if provided
-        if 'custom_instructions' in locals() and custom_instructions:
-            complexity = f"{complexity}. Additional instructions: {custom_instructions}"
-        
-        generated_mindmap = generate_mindmap(
-            topic, 
-            api_key, 
-            theme, 
-            style, 
-            complexity, 
-            aspect_ratio, 
-            image_size
-        )
-        
-        if generated_mindmap:
-            st.session_state.generated_mindmap = generated_mindmap
-            st.success("✅ Mind map generated successfully!")
-            st.balloons()
+    # In fast preview mode the job renders a 2K draft first, then swaps in the full size
+    local = renderer == "Local layout"
+    draft_size = "2K" if fast_preview and image_size != "2K" and not local else None
+    
+    try:
+        job = job_queue.submit(dict(
+            kind="mindmap",
+            topic=topic,
+            theme=theme,
+            style=style,
+            complexity=complexity,
+            aspect_ratio=aspect_ratio,
+            size=image_size,
+            draft_size=draft_size,
+            instructions=custom_instructions,
+            use_cache=use_cache,
+            renderer="local" if local else "image"
+        ), api_key, owner=session_owner)
+    except JobQueueFull as e:
+        # The current mind map keeps rendering
+        st.error(f"⏳ {e}")
+    else:
+        # Nobody is waiting for the mind map this submission replaces; stop paying for it
+        if st.session_state.job_id:
+            job_queue.cancel(st.session_state.job_id, "replaced by a new submission")
+        attach_job(job.id)
+        st.session_state.job_history.append((job.id, topic))
+
+# Follow the current job
+job = job_queue.get(st.session_state.job_id) if st.session_state.job_id else None
+if st.session_state.job_id and job is None:
+    detach_job()
+    st.warning("⌛ That mind map is no longer available. Please generate it again.")
+
+mindmap = session_store.load(st.session_state.generated_mindmap)
+if st.session_state.generated_mindmap and mindmap is None:
+    # Evicted after the session sat idle or the server ran short of space; the job still has the image
+    if job is not None:
+        attach_job(job.id)
+        st.rerun()
+    keep_mindmap(None)
+    st.warning("⌛ Your previous mind map has expired. Please generate it again.")
+
+if job is not None:
+    if job.status == "cancelled":
+        st.info(f"⏹️ Rendering stopped before the mind map was finished ({job.error}).")
+    elif job.error:
+        st.error(f"Error generating mind map: {job.error}")
+    if not st.session_state.job_done:
+        watch_job()
+    elif job.upgrade_errors:
+        st.caption(f"Kept the fast draft: the full-resolution render failed ({job.upgrade_errors[0]}).")
+
+# A locally rendered mind map keeps its concept tree, so it can be redrawn in another theme without an API call
+mindmap_tree = None
+if job is not None and job.params.get("renderer") == "local" and st.session_state.job_done:
+    mindmap_tree = job.outline
+if mindmap and mindmap_tree:
+    theme_key = f"theme_{job.id}"
+    if theme_key not in st.session_state:
+        st.session_state[theme_key] = job.params["theme"]
+    mindmap_theme = st.selectbox("🎨 Re-theme instantly:", list(THEME_PALETTES), key=theme_key)
+    if mindmap_theme != (st.session_state.mindmap_theme or job.params["theme"]):
+        mindmap = render_png(mindmap_tree, mindmap_theme, job.params["aspect_ratio"], job.params["size"])
+        keep_mindmap(mindmap)
+        st.session_state.mindmap_theme = mindmap_theme
 
 # Display the generated mind map
-if st.session_state.generated_mindmap:
-    st.subheader("Your Mind Map:")
-    st.image(st.session_state.generated_mindmap, use_container_width=True)
+if mindmap:
+    if st.session_state.pop("celebrate", False):
+        st.success("✅ Mind map generated successfully!")
+        st.balloons()
     
-    # Download button
-    img_buffer = io.BytesIO()
-    st.session_state.generated_mindmap.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
+    st.subheader("Your Mind Map:")
+    st.image(mindmap.preview_bytes(), use_container_width=True)
     
+    file_stem = f"mindmap_{(job.params['topic'] if job else topic)[:30].replace(' ', '_')}"
     col1, col2 = st.columns(2)
     with col1:
         st.download_button(
             label="📥 Download Mind Map (PNG)",
-            data=img_buffer,
-            file_name=f"mindmap_{topic[:30].replace(' ', '_')}.png",
+            data=mindmap.png_bytes(),
+            file_name=f"{file_stem}.png",
             mime="image/png",
             use_container_width=True
         )
+        if mindmap_tree:
+            # Drawn only when clicked; the SVG keeps every label as editable text
+            st.download_button(
+                label="📐 Download Mind Map (SVG)",
+                data=partial(
+                    render_svg, mindmap_tree, st.session_state[f"theme_{job.id}"],
+                    job.params["aspect_ratio"], job.params["size"],
+                ),
+                file_name=f"{file_stem}.svg",
+                mime="image/svg+xml",
+                use_container_width=True
+            )
     
     with col2:
         if st.button("🔄 Generate Another", use_container_width=True):
-            st.session_state.generated_mindmap = None
+            detach_job()
             st.rerun()
 
+# Mind maps from this session; one switched away from here keeps rendering in the background
+if st.session_state.job_history:
+    with st.sidebar:
+        st.markdown("---")
+        st.subheader("🗂️ Your Mind Maps")
+        for past_job_id, past_topic in reversed(st.session_state.job_history):
+            past_job = job_queue.get(past_job_id)
+            st.button(
+                f"{past_topic[:30]} · {past_job.status if past_job else 'expired'}",
+                key=f"job_{past_job_id}",
+                on_click=attach_job,
+                args=(past_job_id,),
+                disabled=past_job is None or past_job_id == st.session_state.job_id,
+                use_container_width=True
+            )
+
+# Sidebar metrics are rendered last so they include this run's requests
+render_metrics_panel()
+
 # Footer
 st.markdown("---")
 st.markdown(
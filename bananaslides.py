@@ -1,9 +1,15 @@
 import os
+import uuid
+from collections import Counter
+from functools import partial
 import streamlit as st
-from google import genai
-from google.genai import types
-from PIL import Image
-import io
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from core import get_image_cache
+from export import EXPORT_FORMATS, export_deck
+from jobs import JobQueueFull, get_job_queue
+from metrics import start_metrics_server
+from metrics_panel import render_metrics_panel
+from session_store import get_session_store
 
 # Setup Streamlit page
 st.set_page_config(
@@ -12,99 +18,142 @@ st.set_page_config(
     layout="centered"
 )
 
-# Initialize session state
+# Expose /metrics when BANANA_METRICS_PORT is set (once per process)
+start_metrics_server()
+
+# Initialize session state; images live in the session store, session_state only holds handles
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if 'generated_slides' not in st.session_state:
     st.session_state.generated_slides = []
+if 'slide_errors' not in st.session_state:
+    st.session_state.slide_errors = {}
+if 'job_id' not in st.session_state:
+    # The background job whose slides this session shows, and the job files already pulled in
+    st.session_state.job_id = None
+    st.session_state.job_files = []
+    st.session_state.job_done = False
+if 'job_history' not in st.session_state:
+    st.session_state.job_history = []
 
-# Setup Client
-@st.cache_resource
-def get_client(api_key):
-    return genai.Client(api_key=api_key)
-
-MODEL_ID = "gemini-3-pro-image-preview"
+session_store = get_session_store()
+session_store.touch(st.session_state.session_id)
+job_queue = get_job_queue()
+# The browser session of this run: its jobs are only cancelled as abandoned once it has been closed for a while
+session_owner = get_script_run_ctx().session_id
 
-def generate_slide(topic, slide_number, total_slides, slide_content, api_key, theme, style, aspect_ratio="16:9", image_size="4K"):
-    """Generate a single presentation slide"""
-    
-    prompt = f"""Create a professional presentation slide.
+def keep_slides(slides):
+    """Spill a new deck to the session store, freeing the slides it replaces; None marks a missing slide"""
+    for slide_handle in st.session_state.generated_slides:
+        session_store.release(slide_handle)
+    session_id = st.session_state.session_id
+    st.session_state.generated_slides = [session_store.put(session_id, slide) if slide else None for slide in slides]
 
-Topic: {topic}
-Slide {slide_number} of {total_slides}
-Slide Content: {slide_content}
+def keep_slide(position, slide):
+    """Replace one slide of the deck, freeing the old one"""
+    session_store.release(st.session_state.generated_slides[position])
+    st.session_state.generated_slides[position] = session_store.put(st.session_state.session_id, slide)
 
-Theme: {theme}
-Style: {style}
+def deck_export(slide_handles, export_format):
+    """Build an export when its download is clicked, reading slides back from the session store one at a time
 
-Requirements:
-- Create a single, clean presentation slide
-- Include a clear title at the top
-- Use bullet points or key information in a readable layout
-- Professional typography and spacing
-- Follow the {theme} color scheme
-- {style} visual design
-- Include relevant icons or simple graphics if appropriate
-- Make text large and readable
-- This is slide {slide_number}, so {"make it an engaging title slide" if slide_number == 1 else "make it a content slide with key points" if slide_number < total_slides else "make it a conclusion/summary slide"}
-- DO NOT include any watermarks or attribution text"""
+    slide_handles has one entry per slide, None for a missing one, so exported files keep the slide numbers.
+    """
+    return export_deck([partial(session_store.load, slide_handle) for slide_handle in slide_handles], export_format)[0]
 
-    try:
-        client = get_client(api_key)
-        response = client.models.generate_content(
-            model=MODEL_ID,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_modalities=["IMAGE"],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                    image_size=image_size
-                )
-            )
-        )
-        
-        for part in response.candidates[0].content.parts:
-            if part.inline_data:
-                image_data = part.inline_data.data
-                img = Image.open(io.BytesIO(image_data))
-                return img
-                
-    except Exception as e:
-        st.error(f"Error generating slide {slide_number}: {e}")
-        return None
+def attach_job(job_id, reused=None):
+    """Show job_id's slides in this session, replacing the current deck; reused slides (position -> file) carry over"""
+    job_files = st.session_state.job_files
+    kept = {
+        idx: file_name for idx, file_name in (reused or {}).items() if idx < len(job_files) and job_files[idx] == file_name
+    }
+    if kept:
+        # The new job copies these files under the same names, so the handles already in the store stay valid
+        for idx, slide_handle in enumerate(st.session_state.generated_slides):
+            if idx not in kept:
+                session_store.release(slide_handle)
+        st.session_state.generated_slides = [
+            slide_handle if idx in kept else None for idx, slide_handle in enumerate(st.session_state.generated_slides)
+        ]
+        st.session_state.job_files = [kept.get(idx) for idx in range(len(job_files))]
+    else:
+        keep_slides([])
+        st.session_state.job_files = []
+    st.session_state.job_id = job_id
+    # A refreshed page is a new session; it takes over the job it reattached to
+    job_queue.claim(job_id, session_owner)
+    st.session_state.job_done = False
+    st.session_state.slide_errors = {}
+    st.query_params["job"] = job_id
 
-def generate_slide_content(topic, num_slides, api_key):
-    """Generate content outline for slides using text generation"""
+def submit_deck(params, api_key, base=None):
+    """Queue a deck job; with a base job, only slides whose fingerprint changed (or that failed) are rendered again"""
     try:
-        client = get_client(api_key)
-        
-        prompt = f"""Create a brief outline for a {num_slides}-slide presentation about: {topic}
-
-For each slide, provide:
-- A short title (max 5 words)
-- 2-3 key bullet points (max 8 words each)
-
-Format your response exactly like this:
-SLIDE 1:
-Title: [title here]
-Points: [point 1] | [point 2] | [point 3]
+        new_job = job_queue.submit(dict(params, base_job=base.id if base else None), api_key, owner=session_owner)
+    except JobQueueFull as e:
+        # The current deck keeps rendering
+        st.error(f"⏳ {e}")
+        return
+    # Nobody is waiting for the deck this submission replaces; stop paying for it
+    if st.session_state.job_id:
+        job_queue.cancel(st.session_state.job_id, "replaced by a new submission")
+    attach_job(new_job.id, new_job.reusable(base))
+    sync_job(new_job)
+    st.session_state.job_history.append((new_job.id, params["topic"]))
 
-SLIDE 2:
-Title: [title here]
-Points: [point 1] | [point 2] | [point 3]
+def detach_job():
+    """Clear the deck and stop its job if it is still rendering; the job stays in the sidebar"""
+    if st.session_state.job_id:
+        job_queue.cancel(st.session_state.job_id, "the presentation was closed")
+    keep_slides([])
+    st.session_state.job_id = None
+    st.session_state.job_files = []
+    st.query_params.clear()
 
-(continue for all {num_slides} slides)
+def sync_job(job):
+    """Pull images the job has written since the last poll into the session store; True if the deck changed"""
+    if len(st.session_state.job_files) != job.total:
+        keep_slides([None] * job.total)
+        st.session_state.job_files = [None] * job.total
+    changed = False
+    for idx, file_name in enumerate(job.files):
+        if file_name and file_name != st.session_state.job_files[idx]:
+            slide = job.image(idx)
+            if slide is None:
+                continue
+            keep_slide(idx, slide)
+            st.session_state.job_files[idx] = file_name
+            changed = True
+    if job.errors != st.session_state.slide_errors:
+        st.session_state.slide_errors = dict(job.errors)
+        changed = True
+    return changed
 
-Keep it concise and impactful."""
+@st.fragment(run_every=1)
+def watch_job():
+    """Poll the background job and pull its slides into the page as they arrive"""
+    job = job_queue.get(st.session_state.job_id)
+    if job is None:
+        return
+    changed = sync_job(job)
+    if job.finished:
+        st.session_state.job_done = True
+        st.session_state.celebrate = job.status == "done" and any(job.files)
+        st.rerun()
+    if changed:
+        st.rerun()
+    
+    if job.status == "queued":
+        st.caption("⏳ Waiting for a free worker...")
+    elif job.status == "running":
+        progress_text = f"🎨 Finished {job.completed} of {job.total} slides ({job.slide_workers} at a time)..."
+        st.progress(job.completed / job.total, text=progress_text)
+    else:
+        st.caption("⏳ Showing fast drafts while full-resolution slides render in the background...")
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        
-        return response.text
-        
-    except Exception as e:
-        st.error(f"Error generating content outline: {e}")
-        return None
+# Reattach to the job named in the URL, e.g. after a refresh or a dropped connection
+if st.query_params.get("job") and st.query_params.get("job") != st.session_state.job_id:
+    attach_job(st.query_params.get("job"))
 
 # Sidebar - API Key and Promotion
 with st.sidebar:
@@ -246,80 +295,173 @@ with st.form("slide_generation_form"):
             height=80,
             help="Add any specific requirements or preferences"
         )
-    
-    submitted = st.form_submit_button("🎨 Generate Slides", use_container_width=True)
-
-# Generate slides when form is submitted
-if submitted and topic:
-    st.session_state.generated_slides = []
-    
-    # First, generate content outline
-    with st.spinner("📝 Creating content outline..."):
-        content_outline = generate_slide_content(topic, num_slides, api_key)
         
-        if content_outline:
-            with st.expander("📋 View Content Outline"):
-                st.text(content_outline)
-    
-    # Generate each slide
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for i in range(num_slides):
-        slide_num = i + 1
-        status_text.text(f"🎨 Generating slide {slide_num} of {num_slides}...")
-        progress_bar.progress((i) / num_slides)
-        
-        # Extract relevant content for this slide from outline
-        slide_content = f"Slide {slide_num} content from: {content_outline}" if content_outline else f"Slide {slide_num} about {topic}"
-        
-        if custom_instructions:
-            slide_content += f". Additional requirements: {custom_instructions}"
+        max_parallel = st.slider(
+            "Parallel Requests:",
+            min_value=1,
+            max_value=10,
+            value=4,
+            help="How many slides to render at the same time"
+        )
         
-        slide_image = generate_slide(
-            topic=topic,
-            slide_number=slide_num,
-            total_slides=num_slides,
-            slide_content=slide_content,
-            api_key=api_key,
-            theme=theme,
-            style=style,
-            aspect_ratio=aspect_ratio,
-            image_size=image_size
+        use_cache = st.checkbox(
+            "Reuse cached images",
+            value=True,
+            help="Serve identical slides from the local image cache. Uncheck to force a fresh render."
         )
         
-        if slide_image:
-            st.session_state.generated_slides.append(slide_image)
+        fast_preview = st.checkbox(
+            "Fast preview",
+            value=False,
+            help="Show quick 2K drafts first, then swap in full-quality renders as they are ready"
+        )
         
-        progress_bar.progress((i + 1) / num_slides)
-    
-    status_text.empty()
-    progress_bar.empty()
+        time_budget = st.number_input(
+            "Time Budget (seconds, 0 for none):",
+            min_value=0,
+            max_value=600,
+            value=0,
+            step=15,
+            help="Finish the deck within this time. Each slide's quality, the number of parallel requests (up to the "
+                 "setting above) and whether to show drafts first are chosen from recent render times."
+        )
+        cache_stats = get_image_cache().stats()
+        st.caption(
+            f"Image cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} images "
+            f"({cache_stats['bytes'] / 1024 / 1024:.1f} of {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB)"
+        )
     
-    if st.session_state.generated_slides:
-        st.success(f"✅ Generated {len(st.session_state.generated_slides)} slides successfully!")
-        st.balloons()
+    submitted = st.form_submit_button("🎨 Generate Slides", use_container_width=True)
+
+# Queue the deck as a background job; it keeps rendering across reruns, refreshes and disconnects
+if submitted and topic:
+    # In fast preview mode the job renders 2K drafts first, then swaps in full-size slides;
+    # under a time budget the planner decides
+    draft_size = "2K" if fast_preview and image_size != "2K" and not time_budget else None
+    deck_params = dict(
+        kind="slides",
+        topic=topic,
+        num_slides=num_slides,
+        theme=theme,
+        style=style,
+        aspect_ratio=aspect_ratio,
+        size=image_size,
+        draft_size=draft_size,
+        instructions=custom_instructions,
+        use_cache=use_cache,
+        slide_workers=max_parallel,
+        deadline=time_budget or None
+    )
+    # A fresh outline and fresh slides; only Update Changed Slides and Retry Failed Slides reuse the current deck
+    submit_deck(deck_params, api_key)
+
+# Follow the current job
+job = job_queue.get(st.session_state.job_id) if st.session_state.job_id else None
+if st.session_state.job_id and job is None:
+    detach_job()
+    st.warning("⌛ That presentation is no longer available. Please generate it again.")
+
+slide_handles = st.session_state.generated_slides
+slides = [session_store.load(slide_handle) for slide_handle in slide_handles]
+if any(slide_handle and slide is None for slide_handle, slide in zip(slide_handles, slides)):
+    # Evicted after the session sat idle or the server ran short of space; the job still has the images
+    if job is not None:
+        attach_job(job.id)
+        st.rerun()
+    keep_slides([])
+    slides = []
+    st.warning("⌛ Your previous presentation has expired. Please generate it again.")
+
+if job is not None:
+    if job.status == "cancelled":
+        st.info(f"⏹️ Rendering stopped before the deck was finished ({job.error}). Retry to render the missing slides.")
+    elif job.error:
+        st.error(f"Error generating slides: {job.error}")
+    if job.outline_error:
+        st.error(f"Error generating content outline: {job.outline_error}")
+    if job.plan:
+        plan = job.plan
+        budget = job.params["deadline"]
+        size_counts = sorted(Counter(plan["sizes"].values()).items(), reverse=True)
+        planned_sizes = ", ".join(f"{count} at {size}" for size, count in size_counts)
+        if "deadline_met" in plan:
+            kept = f"; {len(plan['kept_drafts'])} kept their draft" if plan.get("kept_drafts") else ""
+            if plan["deadline_met"]:
+                st.success(f"⏱️ Finished in {plan['seconds']:.0f}s, within the {budget}s budget ({planned_sizes}{kept})")
+            else:
+                st.warning(f"⏱️ Took {plan['seconds']:.0f}s, over the {budget}s budget ({planned_sizes}{kept})")
+        else:
+            tight = "" if plan["feasible"] else " The budget is tighter than even the lowest quality allows."
+            drafts = f", {plan['draft_size']} drafts first" if plan["draft_size"] else ""
+            if plan.get("draft_seconds"):
+                drafts += f" (all in after about {plan['draft_seconds']:.0f}s)"
+            st.caption(
+                f"⏱️ Planned for {budget}s: {planned_sizes}, {plan['concurrency']} at a time{drafts}; "
+                f"expected about {plan['estimated_seconds']:.0f}s.{tight}"
+            )
+    if job.outline and not job.finished:
+        with st.expander("📋 View Content Outline"):
+            for slide_num, slide_outline in enumerate(job.outline, start=1):
+                st.markdown(f"**Slide {slide_num}: {slide_outline['title']}**")
+                for point in slide_outline["points"]:
+                    st.markdown(f"- {point}")
+    elif job.outline:
+        # Editing the outline re-renders only the slides whose text changed
+        with st.expander("📋 View & Edit Content Outline"):
+            with st.form(f"outline_form_{job.id}"):
+                edited_outline = []
+                for slide_num, slide_outline in enumerate(job.outline, start=1):
+                    title = st.text_input(f"Slide {slide_num} title", slide_outline["title"])
+                    points = st.text_area(
+                        f"Slide {slide_num} points (one per line)", "\n".join(slide_outline["points"]), height=100
+                    )
+                    points = [point.strip() for point in points.splitlines() if point.strip()]
+                    edited_outline.append({"title": title.strip(), "points": points})
+                if st.form_submit_button("🔁 Update Changed Slides", use_container_width=True):
+                    submit_deck(dict(job.params, outline=edited_outline), api_key, base=job)
+                    st.rerun()
+    if not st.session_state.job_done:
+        watch_job()
+    elif job.upgrade_errors:
+        kept_drafts = ", ".join(str(idx + 1) for idx in sorted(job.upgrade_errors))
+        st.caption(f"Kept the fast draft of slide(s) {kept_drafts}: the full-resolution render failed.")
+
+deck_rendering = job is not None and not st.session_state.job_done and job.rendering
+deck_topic = job.params["topic"] if job is not None else topic
 
 # Display generated slides
-if st.session_state.generated_slides:
+if slides:
+    if st.session_state.pop("celebrate", False):
+        st.success(f"✅ Generated {sum(1 for slide in slides if slide)} of {len(slides)} slides successfully!")
+        st.balloons()
+    
     st.subheader("📊 Your Presentation Slides:")
     
     # Slide navigation with tabs
-    tabs = st.tabs([f"Slide {i+1}" for i in range(len(st.session_state.generated_slides))])
+    tabs = st.tabs([f"Slide {i+1}" if slide or deck_rendering else f"Slide {i+1} ⚠️" for i, slide in enumerate(slides)])
     
-    for idx, (tab, slide) in enumerate(zip(tabs, st.session_state.generated_slides)):
+    for idx, (tab, slide) in enumerate(zip(tabs, slides)):
         with tab:
-            st.image(slide, use_container_width=True)
+            if slide is None:
+                if deck_rendering and idx not in st.session_state.slide_errors:
+                    st.info("⏳ Rendering this slide...")
+                    continue
+                slide_error = st.session_state.slide_errors.get(idx, "no image returned")
+                st.warning(f"Slide {idx + 1} couldn't be generated: {slide_error}")
+                if job is not None and job.finished and st.button("🔁 Retry Failed Slides", key=f"retry_{idx}"):
+                    # A follow-up job reuses every slide that rendered and only retries the failed ones
+                    submit_deck(dict(job.params, outline=job.outline), api_key, base=job)
+                    st.rerun()
+                continue
             
-            # Individual download button
-            img_buffer = io.BytesIO()
-            slide.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
+            st.image(slide.preview_bytes(), use_container_width=True)
             
+            # Individual download button
             st.download_button(
                 label=f"📥 Download Slide {idx + 1}",
-                data=img_buffer,
-                file_name=f"slide_{idx + 1}_{topic[:20].replace(' ', '_')}.png",
+                data=slide.png_bytes(),
+                file_name=f"slide_{idx + 1}_{deck_topic[:20].replace(' ', '_')}.png",
                 mime="image/png",
                 key=f"download_{idx}"
             )
@@ -329,33 +471,50 @@ if st.session_state.generated_slides:
     # Download all slides
     col1, col2 = st.columns(2)
     
+    rendered_handles = [slide_handle for slide_handle, slide in zip(slide_handles, slides) if slide]
     with col1:
-        # Create a zip file with all slides
-        import zipfile
-        
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for idx, slide in enumerate(st.session_state.generated_slides):
-                img_buffer = io.BytesIO()
-                slide.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                zip_file.writestr(f"slide_{idx + 1}.png", img_buffer.getvalue())
-        
-        zip_buffer.seek(0)
-        
-        st.download_button(
-            label="📦 Download All Slides (ZIP)",
-            data=zip_buffer,
-            file_name=f"presentation_{topic[:20].replace(' ', '_')}.zip",
-            mime="application/zip",
-            use_container_width=True
-        )
+        if rendered_handles and not deck_rendering:
+            export_format = st.selectbox(
+                "Export Format:",
+                list(EXPORT_FORMATS),
+                help="PNG keeps full quality, WebP is much smaller, PDF and PowerPoint give a single file"
+            )
+            
+            # Nothing is exported until the button is clicked; the file is then streamed to a spooled temp file
+            _, _, export_mime, export_extension = EXPORT_FORMATS[export_format]
+            
+            st.download_button(
+                label=f"📦 Download All Slides ({export_format})",
+                data=partial(deck_export, slide_handles, export_format),
+                file_name=f"presentation_{deck_topic[:20].replace(' ', '_')}.{export_extension}",
+                mime=export_mime,
+                use_container_width=True
+            )
     
     with col2:
         if st.button("🔄 Generate New Presentation", use_container_width=True):
-            st.session_state.generated_slides = []
+            detach_job()
             st.rerun()
 
+# Decks from this session; one switched away from here keeps rendering in the background
+if st.session_state.job_history:
+    with st.sidebar:
+        st.markdown("---")
+        st.subheader("🗂️ Your Presentations")
+        for past_job_id, past_topic in reversed(st.session_state.job_history):
+            past_job = job_queue.get(past_job_id)
+            st.button(
+                f"{past_topic[:30]} · {past_job.status if past_job else 'expired'}",
+                key=f"job_{past_job_id}",
+                on_click=attach_job,
+                args=(past_job_id,),
+                disabled=past_job is None or past_job_id == st.session_state.job_id,
+                use_container_width=True
+            )
+
+# Sidebar metrics are rendered last so they include this run's requests
+render_metrics_panel()
+
 # Footer
 st.markdown("---")
 st.markdown(
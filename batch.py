@@ -0,0 +1,162 @@
+"""Headless batch generation of mind maps and slide decks from a JSONL job file
+
+Usage:
+    python batch.py jobs.jsonl --out renders/ --workers 4
+
+Each line of the job file is a JSON object:
+    {"id": "ml-deck", "kind": "slides", "topic": "Machine Learning", "num_slides": 5, "size": "4K"}
+    {"kind": "mindmap", "topic": "Healthy Living Tips", "theme": "Ocean Blues", "complexity": "Simple (3-5 main branches)"}
+    {"kind": "mindmap", "topic": "Climate Change Solutions", "renderer": "local"}
+
+Only "topic" is required. Images land in <out>/<job id>/ and every finished job is appended to
+<out>/manifest.jsonl; rerunning the same command skips jobs the manifest already records as done.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core import (
+    JOB_DEFAULTS, build_slide_requests, generate_mindmap_tree, generate_outline, render_mindmap, render_slides, write_image
+)
+
+
+def load_jobs(path):
+    """Read the job file, filling in defaults and a stable id for jobs that do not name one"""
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            job = dict(JOB_DEFAULTS, **json.loads(line))
+            if not job.get("topic"):
+                raise ValueError(f"{path}:{line_number}: job has no topic")
+            if job["kind"] not in ("slides", "mindmap"):
+                raise ValueError(f"{path}:{line_number}: unknown job kind {job['kind']!r}")
+            if job.get("renderer", "image") not in ("image", "local"):
+                raise ValueError(f"{path}:{line_number}: unknown renderer {job['renderer']!r}")
+            if "id" not in job:
+                canonical = json.dumps(job, sort_keys=True, ensure_ascii=False)
+                job["id"] = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+            jobs.append(job)
+    return jobs
+
+
+def load_finished(manifest_path):
+    """Ids of jobs the manifest records as completed"""
+    finished = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if entry.get("status") == "ok":
+                    finished.add(entry["id"])
+    return finished
+
+
+def run_job(job, api_key, out_dir, slide_workers):
+    """Render one job into its own directory; returns the written file names and elapsed seconds"""
+    started = time.monotonic()
+    files = _render_job(job, api_key, out_dir, slide_workers)
+    return files, round(time.monotonic() - started, 2)
+
+
+def _render_job(job, api_key, out_dir, slide_workers):
+    job_dir = os.path.join(out_dir, job["id"])
+    os.makedirs(job_dir, exist_ok=True)
+    complexity = job["complexity"]
+    if job["instructions"]:
+        complexity = f"{complexity}. Additional instructions: {job['instructions']}"
+
+    if job["kind"] == "mindmap" and job.get("renderer") == "local":
+        from mindmap_renderer import render_png, render_svg
+
+        tree = generate_mindmap_tree(job["topic"], job["complexity"], api_key, job["instructions"])
+        with open(os.path.join(job_dir, "mindmap.json"), "w", encoding="utf-8") as f:
+            json.dump(tree, f, indent=2, ensure_ascii=False)
+        with open(os.path.join(job_dir, "mindmap.svg"), "w", encoding="utf-8") as f:
+            f.write(render_svg(tree, job["theme"], job["aspect_ratio"], job["size"]))
+        image = render_png(tree, job["theme"], job["aspect_ratio"], job["size"])
+        return [write_image(job_dir, "mindmap", image), "mindmap.svg"]
+
+    if job["kind"] == "mindmap":
+        mindmap = render_mindmap(
+            job["topic"], api_key, job["theme"], job["style"], complexity,
+            job["aspect_ratio"], job["size"]
+        )
+        if mindmap is None:
+            raise RuntimeError("the model returned no image")
+        return [write_image(job_dir, "mindmap", mindmap)]
+
+    num_slides = int(job["num_slides"])
+    outline = generate_outline(job["topic"], num_slides, api_key)
+    with open(os.path.join(job_dir, "outline.json"), "w", encoding="utf-8") as f:
+        json.dump(outline, f, indent=2, ensure_ascii=False)
+
+    slide_requests = build_slide_requests(
+        job["topic"], num_slides, outline, job["theme"], job["style"],
+        job["aspect_ratio"], job["size"], job["instructions"]
+    )
+    errors = []
+
+    def on_slide_done(idx, slide_image, error, completed):
+        if error or slide_image is None:
+            errors.append(f"slide {idx + 1}: {error or 'the model returned no image'}")
+
+    slides = render_slides(slide_requests, api_key, slide_workers, on_slide_done)
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return [write_image(job_dir, f"slide_{idx + 1:02d}", slide) for idx, slide in enumerate(slides)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("jobs", help="JSONL file with one job per line")
+    parser.add_argument("--out", default="renders", help="output directory (default: renders)")
+    parser.add_argument("--workers", type=int, default=4, help="jobs rendered at the same time (default: 4)")
+    parser.add_argument("--slide-workers", type=int, default=4, help="parallel slide requests per deck (default: 4)")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"), help="defaults to $GOOGLE_API_KEY")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("no API key: pass --api-key or set GOOGLE_API_KEY")
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, "manifest.jsonl")
+    jobs = load_jobs(args.jobs)
+    finished = load_finished(manifest_path)
+    pending = [job for job in jobs if job["id"] not in finished]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run", file=sys.stderr)
+
+    failures = 0
+    with open(manifest_path, "a", encoding="utf-8") as manifest, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(run_job, job, args.api_key, args.out, args.slide_workers): job
+            for job in pending
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            entry = {"id": job["id"], "kind": job["kind"], "topic": job["topic"]}
+            try:
+                files, seconds = future.result()
+                entry.update(status="ok", files=files, seconds=seconds)
+            except Exception as e:
+                failures += 1
+                entry.update(status="error", error=str(e))
+            # Flushed per job so an interrupted run can resume from here
+            manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            manifest.flush()
+            print(f"[{entry['status']}] {job['id']} {job['topic'][:40]}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""Load test of the Streamlit apps: many simulated sessions in one server process against the stub backend
+
+Usage:
+    python benchmarks/loadtest.py [--app bananaslides.py] [--sessions 1 2 4 8 16] [--slides 3] [--size 2K]
+                                  [--latency-scale 1.0] [--poll 1.0] [--json results.json] [--baseline old.json]
+
+Each step of the ramp runs that many sessions at once. Every session drives the real script with
+streamlit's AppTest: it enters a key, submits a deck (or mind map) on a topic of its own, then
+reruns the page once per --poll seconds, as the page's polling fragment does, until the result is
+shown. Reports, per step, end-to-end latency percentiles per session (submit to finished page),
+the wall time of a script rerun, peak process RSS and CPU use.
+
+AppTest swaps process-wide Streamlit state on every run, so script runs are serialized; the time
+sessions waited for their turn is reported separately as "queue". Background jobs, API calls and
+exports run concurrently, as they do in a real server. With --baseline, exits non-zero if any
+step's p95 latency or rerun time got worse than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ["BANANA_STUB_BACKEND"] = "1"
+# Keep load test jobs, images and history out of the user's real directories
+SCRATCH_DIR = tempfile.mkdtemp(prefix="banana-load-")
+for name, sub in (("BANANA_CACHE_DIR", "cache"), ("BANANA_JOBS_DIR", "jobs"), ("BANANA_GALLERY_DIR", "gallery"),
+                  ("BANANA_SESSION_DIR", "sessions")):
+    os.environ.setdefault(name, os.path.join(SCRATCH_DIR, sub))
+
+from metrics import percentile  # noqa: E402
+from pipeline import StageProbe  # noqa: E402
+from stub_backend import DEFAULT_LATENCY  # noqa: E402
+
+# One script run at a time: AppTest installs its own Streamlit runtime for the duration of a run
+SCRIPT_LOCK = threading.Lock()
+
+SUBMIT_LABELS = {"bananaslides.py": "🎨 Generate Slides", "app.py": "🎨 Generate Mind Map"}
+
+
+def _widget(elements, label):
+    return next(element for element in elements if element.label == label)
+
+
+class Session:
+    """One simulated user: load the page, submit a job, poll until its result is shown"""
+
+    def __init__(self, script, api_key, topic, args):
+        self.script = script
+        self.api_key = api_key
+        self.topic = topic
+        self.args = args
+        self.reruns = []
+        self.queue = []
+        self.latency = None
+        self.outcome = "pending"
+        self.error = None
+
+    def _rerun(self, app):
+        queued = time.perf_counter()
+        with SCRIPT_LOCK:
+            started = time.perf_counter()
+            app.run()
+            self.reruns.append(time.perf_counter() - started)
+        self.queue.append(started - queued)
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        try:
+            app = AppTest.from_file(os.path.join(REPO_ROOT, self.script), default_timeout=self.args.timeout)
+            self._rerun(app)
+            _widget(app.text_input, "Google API Key:").input(self.api_key)
+            self._rerun(app)
+            app.text_area[0].input(self.topic)
+            _widget(app.selectbox, "Image Quality:").set_value(self.args.size)
+            if self.script == "bananaslides.py":
+                _widget(app.selectbox, "Number of Slides:").set_value(self.args.slides)
+            elif self.args.renderer == "local":
+                _widget(app.radio, "Renderer:").set_value("Local layout")
+            _widget(app.button, SUBMIT_LABELS[self.script]).click()
+            submitted = time.perf_counter()
+            self._rerun(app)
+            if any("⏳" in str(error.value) for error in app.error):
+                # The job queue is full: this is what a real user sees too
+                self.outcome = "rejected"
+                return
+            deadline = submitted + self.args.timeout
+            while not app.session_state["job_done"]:
+                if time.perf_counter() > deadline:
+                    self.outcome = "timeout"
+                    return
+                time.sleep(self.args.poll)
+                self._rerun(app)
+            self.latency = time.perf_counter() - submitted
+            self.outcome = "ok"
+        except Exception as e:
+            self.outcome, self.error = "error", str(e)
+
+
+def run_step(script, sessions, args, step):
+    """Run sessions simulated users at once, their arrivals spread over --spread seconds"""
+    users = [
+        Session(script, f"load-{step}-{n}" if not args.shared_key else "load", f"Load test topic {step}-{n}", args)
+        for n in range(sessions)
+    ]
+    threads = [threading.Thread(target=user.run, daemon=True) for user in users]
+    with StageProbe(sample_interval=0.05) as probe:
+        for n, thread in enumerate(threads):
+            thread.start()
+            if n < len(threads) - 1:
+                time.sleep(args.spread / max(sessions - 1, 1))
+        for thread in threads:
+            thread.join()
+
+    latencies = sorted(user.latency for user in users if user.latency is not None)
+    reruns = sorted(seconds for user in users for seconds in user.reruns)
+    queue = sorted(seconds for user in users for seconds in user.queue)
+    outcomes = [user.outcome for user in users]
+    errors = sorted({user.error for user in users if user.error})
+
+    def seconds(values, q):
+        value = percentile(values, q)
+        return None if value is None else round(value, 3)
+
+    def ms(values, q):
+        value = percentile(values, q)
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "sessions": sessions,
+        "ok": outcomes.count("ok"),
+        "rejected": outcomes.count("rejected"),
+        "timeout": outcomes.count("timeout"),
+        "error": outcomes.count("error"),
+        "e2e_p50_s": seconds(latencies, 0.5),
+        "e2e_p95_s": seconds(latencies, 0.95),
+        "e2e_max_s": seconds(latencies, 1.0),
+        "reruns": len(reruns),
+        "rerun_p50_ms": ms(reruns, 0.5),
+        "rerun_p95_ms": ms(reruns, 0.95),
+        "queue_p95_ms": ms(queue, 0.95),
+        "peak_rss_mb": round(probe.peak_rss / 1024 / 1024, 1),
+        "cpu_util": round(probe.cpu / probe.wall, 2) if probe.wall else None,
+        "wall_s": round(probe.wall, 2),
+        "errors": errors[:3],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """p95 latency and rerun regressions against a previous --json run"""
+    regressions = []
+    for step, measured in results.items():
+        previous = baseline.get(step)
+        if not previous:
+            continue
+        for key in ("e2e_p95_s", "rerun_p95_ms"):
+            if previous.get(key) and measured.get(key) and measured[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{step} / {key}: {previous[key]} -> {measured[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--app", choices=sorted(SUBMIT_LABELS), default="bananaslides.py",
+                        help="script to load (default: bananaslides.py)")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="concurrent sessions per ramp step (default: 1 2 4 8 16)")
+    parser.add_argument("--slides", type=int, default=3, help="slides per deck (default: 3)")
+    parser.add_argument("--size", choices=["2K", "4K"], default="2K", help="image quality (default: 2K)")
+    parser.add_argument("--renderer", choices=["image", "local"], default="image",
+                        help="mind map renderer for app.py (default: image)")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiplier on the stub's simulated API latency (default: 1)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter fraction (default: 0.2)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub requests failing with 503")
+    parser.add_argument("--image-scale", type=float, default=0.25, help="multiplier on image dimensions (default: 0.25)")
+    parser.add_argument("--poll", type=float, default=1.0,
+                        help="seconds between a session's reruns while waiting (default: 1)")
+    parser.add_argument("--spread", type=float, default=2.0, help="seconds over which a step's sessions arrive (default: 2)")
+    parser.add_argument("--timeout", type=float, default=300.0,
+                        help="give up on a session after this many seconds (default: 300)")
+    parser.add_argument("--shared-key", action="store_true", help="all sessions use one API key, sharing its rate limit")
+    parser.add_argument("--max-p95", type=float,
+                        help="stop the ramp after a step whose p95 latency exceeds this many seconds")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    # Stub clients are created per key on first use and read their settings from the environment
+    for kind, seconds in DEFAULT_LATENCY.items():
+        os.environ[f"BANANA_STUB_LATENCY_{kind.upper()}"] = str(seconds * args.latency_scale)
+    os.environ["BANANA_STUB_JITTER"] = str(args.jitter)
+    os.environ["BANANA_STUB_ERROR_RATE"] = str(args.error_rate)
+    os.environ["BANANA_STUB_SCALE"] = str(args.image_scale)
+    import streamlit.testing.v1  # noqa: F401  (imported up front so the first step is not billed for it)
+
+    results = {}
+    print(f"{args.app}, stub latency x{args.latency_scale}, scratch directory {SCRATCH_DIR}")
+    print(f"  {'sessions':>8}{'ok':>5}{'rej':>5}{'fail':>5}{'p50 (s)':>9}{'p95 (s)':>9}{'max (s)':>9}"
+          f"{'reruns':>8}{'rerun p50/p95 (ms)':>20}{'queue p95 (ms)':>16}{'RSS (MB)':>10}{'CPU':>6}")
+    for step, sessions in enumerate(args.sessions):
+        row = run_step(args.app, sessions, args, step)
+        results[f"{sessions} sessions"] = row
+        print(f"  {sessions:>8}{row['ok']:>5}{row['rejected']:>5}{row['timeout'] + row['error']:>5}"
+              f"{row['e2e_p50_s'] or 0:>9.2f}{row['e2e_p95_s'] or 0:>9.2f}{row['e2e_max_s'] or 0:>9.2f}{row['reruns']:>8}"
+              f"{row['rerun_p50_ms'] or 0:>11.1f}/{row['rerun_p95_ms'] or 0:<8.1f}{row['queue_p95_ms'] or 0:>16.1f}"
+              f"{row['peak_rss_mb']:>10.1f}{row['cpu_util'] or 0:>6.2f}")
+        for error in row["errors"]:
+            print(f"    error: {error}")
+        if args.max_p95 and (row["e2e_p95_s"] is None or row["e2e_p95_s"] > args.max_p95):
+            print(f"  stopping: p95 latency above {args.max_p95}s")
+            break
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Offline benchmark of the slide pipeline (outline -> slides -> export) against the stub backend
+
+Usage:
+    python benchmarks/pipeline.py [--slides 1 5 10] [--sizes 2K 4K] [--latency-scale 1.0]
+                                  [--error-rate 0] [--json results.json] [--baseline old.json]
+
+Reports wall time, CPU time (including export workers), peak RSS growth and throughput per stage
+for every deck size and resolution. With --baseline, exits non-zero if any stage got slower than
+the baseline by more than --tolerance. Also exits non-zero if a deck cancelled part way changes
+the latency estimates the deadline planner works from, or if a wide palette, 1-bit, 16-bit or
+transparent image can't be previewed.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ["BANANA_STUB_BACKEND"] = "1"
+# Keep benchmark renders out of the user's real image cache
+os.environ.setdefault("BANANA_CACHE_DIR", tempfile.mkdtemp(prefix="banana-bench-"))
+
+import core  # noqa: E402
+import export  # noqa: E402
+import planner  # noqa: E402
+from cancellation import Cancelled, CancelToken  # noqa: E402
+from image_store import PREVIEW_MAX_WIDTH, make_preview  # noqa: E402
+from stub_backend import DEFAULT_LATENCY, StubClient  # noqa: E402
+
+API_KEY = "benchmark"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident set size in bytes (Linux /proc; 0 elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def pool_cpu_seconds():
+    """User + system CPU consumed so far by the export pool's worker processes (Linux only)"""
+    pool = export._pool
+    if pool is None:
+        return 0.0
+    total = 0.0
+    ticks = os.sysconf("SC_CLK_TCK")
+    for pid in list(getattr(pool, "_processes", {}) or {}):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class StageProbe:
+    """Measures wall time, CPU time and peak RSS growth of the enclosed block"""
+
+    def __init__(self, sample_interval=0.005):
+        self.sample_interval = sample_interval
+
+    def __enter__(self):
+        self.peak_rss = self.start_rss = current_rss()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self.start_cpu = time.process_time() + pool_cpu_seconds()
+        self.start_wall = time.perf_counter()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __exit__(self, *exc_info):
+        self.wall = time.perf_counter() - self.start_wall
+        self.cpu = time.process_time() + pool_cpu_seconds() - self.start_cpu
+        self._stop.set()
+        self._sampler.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+    def result(self, items):
+        return {
+            "wall_s": round(self.wall, 4),
+            "cpu_s": round(self.cpu, 4),
+            "peak_rss_growth_mb": round((self.peak_rss - self.start_rss) / 1024 / 1024, 1),
+            "items_per_s": round(items / self.wall, 3) if self.wall else None,
+        }
+
+
+def run_deck(num_slides, image_size, max_workers):
+    """Run one deck through the pipeline and measure every stage"""
+    stages = {}
+    with StageProbe() as probe:
+        outline = core.generate_outline("Benchmark topic", num_slides, API_KEY)
+    stages["outline"] = probe.result(1)
+
+    slide_requests = core.build_slide_requests(
+        "Benchmark topic", num_slides, outline, "Modern Purple & Blue", "Modern & Clean",
+        "16:9", image_size, use_cache=False
+    )
+    with StageProbe() as probe:
+        slides = core.render_slides(slide_requests, API_KEY, max_workers)
+    stages["slides"] = probe.result(num_slides)
+    slides = [slide for slide in slides if slide]
+
+    with StageProbe() as probe:
+        for slide in slides:
+            slide.preview_bytes()
+    stages["preview"] = probe.result(len(slides))
+
+    for export_format in export.EXPORT_FORMATS:
+        with StageProbe() as probe:
+            export.export_deck(slides, export_format)
+        stages[f"export {export_format}"] = probe.result(len(slides))
+
+    return stages
+
+
+def check_cancelled_run(num_slides, image_size, max_workers, cancel_after):
+    """Cancel a deck cancel_after seconds in; returns the planner estimates that moved (size -> (before, after))
+
+    cancel_after must be shorter than any image request, or the calls that legitimately finish move the estimates.
+    """
+    before = {size: planner.image_seconds(size) for size in planner.SIZE_LADDER}
+    slide_requests = core.build_slide_requests(
+        "Cancelled topic", num_slides, None, "Modern Purple & Blue", "Modern & Clean", "16:9", image_size, use_cache=False
+    )
+    cancel = CancelToken()
+    timer = threading.Timer(cancel_after, cancel.cancel, args=("benchmark",))
+    timer.start()
+    try:
+        core.render_slides(slide_requests, API_KEY, max_workers, cancel=cancel)
+    except Cancelled:
+        pass
+    timer.cancel()
+    after = {size: planner.image_seconds(size) for size in planner.SIZE_LADDER}
+    return {size: (before[size], after[size]) for size in before if after[size] != before[size]}
+
+
+def check_preview_modes(modes=("P", "1", "I;16", "LA", "RGBA")):
+    """Preview a PNG more than twice PREVIEW_MAX_WIDTH wide in each mode; returns mode -> what went wrong"""
+    from PIL import Image
+
+    failures = {}
+    for mode in modes:
+        buffer = io.BytesIO()
+        Image.new("RGB", (PREVIEW_MAX_WIDTH * 3, 200), "red").convert(mode).save(buffer, format="PNG")
+        try:
+            preview = Image.open(io.BytesIO(make_preview(buffer.getvalue())))
+        except Exception as e:
+            failures[mode] = repr(e)
+            continue
+        if preview.format != "JPEG" or preview.mode != "RGB" or preview.width != PREVIEW_MAX_WIDTH:
+            failures[mode] = f"{preview.format} {preview.mode} {preview.width}px"
+    return failures
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Stage wall-time regressions against a previous --json run"""
+    regressions = []
+    for case, stages in results.items():
+        for stage, measured in stages.items():
+            previous = baseline.get(case, {}).get(stage)
+            if not previous or measured["wall_s"] - previous["wall_s"] < min_delta:
+                continue
+            if measured["wall_s"] > previous["wall_s"] * (1 + tolerance):
+                regressions.append(f"{case} / {stage}: {previous['wall_s']:.3f}s -> {measured['wall_s']:.3f}s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--slides", type=int, nargs="+", default=[1, 3, 5, 10], help="deck sizes (default: 1 3 5 10)")
+    parser.add_argument("--sizes", nargs="+", default=["2K", "4K"], help="image sizes (default: 2K 4K)")
+    parser.add_argument("--workers", type=int, default=4, help="parallel slide requests (default: 4)")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiplier on the stub's simulated API latency; 0 isolates local overhead (default: 1)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter fraction (default: 0.2)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub requests failing with 503")
+    parser.add_argument("--image-scale", type=float, default=1.0, help="multiplier on image dimensions (default: 1)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs baseline (default: 0.2)")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="ignore slowdowns smaller than this many seconds (default: 0.05)")
+    args = parser.parse_args(argv)
+
+    stub = StubClient(
+        latency={kind: seconds * args.latency_scale for kind, seconds in DEFAULT_LATENCY.items()},
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        scale=args.image_scale,
+        seed=0,
+    )
+    core.get_client_manager().register(API_KEY, stub)
+    # Render the stub's images, import the SDK and start the export pool up front so none of it is billed to a stage
+    for image_size in args.sizes:
+        stub.image_bytes(image_size, "16:9")
+    core.generate_outline("warm-up", 1, API_KEY)
+    export.get_export_pool().submit(int).result()
+
+    results = {}
+    for image_size in args.sizes:
+        for num_slides in args.slides:
+            case = f"{num_slides} slides @ {image_size}"
+            results[case] = run_deck(num_slides, image_size, args.workers)
+            print(f"\n{case}")
+            print(f"  {'stage':<26}{'wall (s)':>10}{'cpu (s)':>10}{'peak RSS +MB':>14}{'items/s':>10}")
+            for stage, row in results[case].items():
+                print(
+                    f"  {stage:<26}{row['wall_s']:>10.3f}{row['cpu_s']:>10.3f}"
+                    f"{row['peak_rss_growth_mb']:>14.1f}{row['items_per_s'] or 0:>10.2f}"
+                )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # Abandoned calls must not feed the latency history: the planner would think every size is instant.
+    # Cancel well before the quickest image could come back, so no call finishes on its own
+    image_latency = stub.latency.get(args.sizes[-1], stub.latency["4K"]) * (1 - args.jitter)
+    moved = check_cancelled_run(4, args.sizes[-1], args.workers, cancel_after=image_latency / 4)
+    if moved:
+        print("\nA cancelled deck changed the planner's estimates:\n  " + "\n  ".join(
+            f"{size}: {before:.3f}s -> {after:.3f}s" for size, (before, after) in moved.items()))
+        return 1
+    print("\nA cancelled deck left the planner's estimates unchanged.")
+
+    # Every image shown or kept in the history gets a preview, whatever mode the PNG is in
+    failures = check_preview_modes()
+    if failures:
+        print("\nPreviews failed:\n  " + "\n  ".join(f"{mode}: {error}" for mode, error in failures.items()))
+        return 1
+    print("Previews work for palette, 1-bit, 16-bit and transparent images.")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Measure import time and memory of the headless core and the Streamlit entry points
+
+Usage:
+    python benchmarks/startup.py [--repeat 5] [--json]
+
+Every target is loaded in a fresh interpreter. Timings cover the import alone; memory includes
+the interpreter's own baseline, shown as the "python" row.
+Streamlit scripts run in bare mode (no server) and stop at the API key prompt, which covers
+all of their module-level setup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["streamlit", "google.genai", "PIL.Image", "httpx", "numpy"]
+
+TARGETS = {
+    "core": "import core",
+    "batch": "import batch",
+    "app.py (UI)": "run_script('app.py')",
+    "bananaslides.py (UI)": "run_script('bananaslides.py')",
+}
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+
+def run_script(path):
+    import logging, runpy
+    logging.disable(logging.WARNING)
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except BaseException:
+        pass
+
+{statement}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(statement):
+    """Run statement in a fresh interpreter and return its timing and memory report"""
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per target (default: 5)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    python_only = [measure("pass") for _ in range(args.repeat)]
+    results = {"python": python_only}
+    for name, statement in TARGETS.items():
+        results[name] = [measure(statement) for _ in range(args.repeat)]
+
+    summary = {}
+    for name, runs in results.items():
+        summary[name] = {
+            "median_seconds": round(statistics.median(run["seconds"] for run in runs), 3),
+            "max_rss_mb": round(max(run["max_rss_mb"] for run in runs), 1),
+            "loaded": runs[-1]["loaded"],
+        }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"{'target':<24}{'startup (s)':>12}{'RSS (MB)':>10}  heavy modules loaded")
+    for name, row in summary.items():
+        print(f"{name:<24}{row['median_seconds']:>12.3f}{row['max_rss_mb']:>10.1f}  {', '.join(row['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Cooperative cancellation tokens for generation runs
+
+A job hands one CancelToken to everything it starts: the outline call, every image request, the
+scheduler's quota waits and retries. Work checks the token before it starts and while it waits,
+so queued work is dropped as soon as the token is cancelled, and callers blocked on an API call
+stop waiting at once (see RequestScheduler.call).
+"""
+import threading
+
+
+class Cancelled(Exception):
+    """Raised by work that stopped because its CancelToken was cancelled"""
+
+
+class CancelToken:
+    """Set once by cancel(); checked by whoever does work on behalf of the run"""
+
+    def __init__(self):
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel the run; returns False if it already was"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def check(self):
+        """Raise Cancelled if the run was cancelled"""
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def wait(self, timeout):
+        """Sleep for up to timeout seconds, waking early on cancellation; True if cancelled"""
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback):
+        """Call callback() once when the run is cancelled, right away if it already is
+
+        Returns a function that unregisters it.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
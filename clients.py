@@ -0,0 +1,144 @@
+"""Bounded set of Gemini clients sharing one keep-alive connection pool
+
+Every API key gets its own genai.Client, but all of them send requests through a single httpx
+connection pool (the key travels as a per-request header), so a new tenant reuses warm TLS
+connections instead of paying for its own handshakes. Clients idle longer than a TTL, or beyond
+the LRU bound, are closed. Tuned with:
+
+    BANANA_MAX_CLIENTS           clients kept at once (default 32)
+    BANANA_CLIENT_IDLE_SECONDS   idle time before a client is dropped (default 900)
+    BANANA_HTTP_POOL_SIZE        connections shared by all clients, kept alive between requests (default 32)
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+MAX_CLIENTS = int(os.environ.get("BANANA_MAX_CLIENTS", "32"))
+IDLE_SECONDS = float(os.environ.get("BANANA_CLIENT_IDLE_SECONDS", "900"))
+HTTP_POOL_SIZE = int(os.environ.get("BANANA_HTTP_POOL_SIZE", "32"))
+KEEPALIVE_SECONDS = 120
+
+
+def key_fingerprint(api_key):
+    """Short, non-reversible label for an API key, safe to show in stats"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+class _Entry:
+    def __init__(self, client):
+        self.client = client
+        self.created = self.last_used = time.monotonic()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+
+
+class ClientManager:
+    """LRU/TTL-bounded clients per API key, with per-key concurrency stats"""
+
+    def __init__(self, max_clients=MAX_CLIENTS, idle_seconds=IDLE_SECONDS, pool_size=HTTP_POOL_SIZE, factory=None):
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self.pool_size = pool_size
+        self._factory = factory or self._genai_client
+        self._entries = OrderedDict()  # api_key -> _Entry, least recently used first
+        self._http = None
+        self._lock = threading.Lock()
+        self._counts = {"created": 0, "evicted": 0}
+
+    def _http_client(self):
+        """The httpx client every genai client shares; created on first use"""
+        if self._http is None:
+            import httpx
+
+            self._http = httpx.Client(
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=KEEPALIVE_SECONDS,
+                ),
+            )
+        return self._http
+
+    def _genai_client(self, api_key):
+        from google import genai
+        from google.genai import types
+
+        return genai.Client(api_key=api_key, http_options=types.HttpOptions(httpx_client=self._http_client()))
+
+    def get(self, api_key):
+        """The client for api_key, creating it (and evicting idle or surplus clients) as needed"""
+        with self._lock:
+            entry = self._touch(api_key)
+            return entry.client
+
+    @contextmanager
+    def lease(self, api_key):
+        """The client for api_key, counted as in flight (and never evicted) for the enclosed block"""
+        with self._lock:
+            entry = self._touch(api_key)
+            entry.in_flight += 1
+            entry.calls += 1
+            entry.peak_in_flight = max(entry.peak_in_flight, entry.in_flight)
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+                entry.last_used = time.monotonic()
+
+    def register(self, api_key, client):
+        """Use client for api_key from now on, e.g. a stub in benchmarks"""
+        with self._lock:
+            self._entries[api_key] = _Entry(client)
+            self._evict(keep=api_key)
+
+    def _touch(self, api_key):
+        entry = self._entries.get(api_key)
+        if entry is None:
+            entry = self._entries[api_key] = _Entry(self._factory(api_key))
+            self._counts["created"] += 1
+        else:
+            self._entries.move_to_end(api_key)
+        entry.last_used = time.monotonic()
+        self._evict(keep=api_key)
+        return entry
+
+    def _evict(self, keep):
+        """Close clients idle past the TTL, then least recently used ones beyond the bound"""
+        cutoff = time.monotonic() - self.idle_seconds
+        surplus = len(self._entries) - self.max_clients
+        for api_key, entry in list(self._entries.items()):
+            if api_key == keep or entry.in_flight:
+                continue
+            if entry.last_used < cutoff or surplus > 0:
+                del self._entries[api_key]
+                surplus -= 1
+                self._counts["evicted"] += 1
+                close = getattr(entry.client, "close", None)
+                if close is not None:
+                    # The shared httpx pool stays open; genai only closes pools it created itself
+                    close()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return dict(
+                self._counts,
+                clients=len(self._entries),
+                in_flight=sum(entry.in_flight for entry in self._entries.values()),
+                pool_size=self.pool_size,
+                keys={
+                    key_fingerprint(api_key): {
+                        "in_flight": entry.in_flight,
+                        "peak_in_flight": entry.peak_in_flight,
+                        "calls": entry.calls,
+                        "idle_seconds": round(now - entry.last_used, 1),
+                    }
+                    for api_key, entry in self._entries.items()
+                },
+            )
@@ -0,0 +1,572 @@
+"""Generation logic shared by the Streamlit apps and headless workers
+
+This module must not import streamlit, and google.genai is only imported on first use, so
+workers that never call the API (or only read the cache) start fast and stay small.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cancellation import Cancelled
+from clients import ClientManager
+from image_cache import ImageCache, cache_key
+from image_store import StoredImage
+from metrics import metrics
+from scheduler import get_scheduler
+from singleflight import SingleFlight
+
+MODEL_ID = "gemini-3-pro-image-preview"
+OUTLINE_MODEL_ID = "gemini-2.0-flash"
+
+# Settings a batch or background job uses for anything it does not specify; only "topic" is required
+JOB_DEFAULTS = {
+    "kind": "slides",
+    "theme": "Modern Purple & Blue",
+    "style": "Modern & Clean",
+    "complexity": "Moderate (5-7 main branches)",
+    "num_slides": 3,
+    "size": "4K",
+    "aspect_ratio": "16:9",
+    "instructions": "",
+}
+
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+
+_client_manager = None
+_image_cache = None
+_lock = threading.Lock()
+
+# Identical image requests in flight at the same moment (double submits, a whole workshop
+# typing the README example) wait on one API call instead of each paying for their own
+image_flights = SingleFlight()
+
+metrics.register_collector("image_cache", lambda: get_image_cache().stats())
+metrics.register_collector("clients", lambda: get_client_manager().stats())
+metrics.register_collector("scheduler", lambda: dict(get_scheduler().stats, **get_scheduler().gauges()))
+metrics.register_collector("flights", image_flights.stats)
+
+
+def get_client_manager():
+    """The bounded set of per-key clients shared by every caller in the process"""
+    global _client_manager
+    with _lock:
+        if _client_manager is None:
+            if os.environ.get("BANANA_STUB_BACKEND"):
+                # Offline benchmarks and load tests: a local backend with simulated latency
+                from stub_backend import StubClient
+
+                _client_manager = ClientManager(factory=lambda api_key: StubClient.from_env())
+            else:
+                _client_manager = ClientManager()
+        return _client_manager
+
+
+def get_image_cache():
+    """The on-disk image cache shared by every caller in the process"""
+    global _image_cache
+    with _lock:
+        if _image_cache is None:
+            _image_cache = ImageCache()
+        return _image_cache
+
+
+def build_mindmap_prompt(topic, theme, style, complexity):
+    return f"""Create a detailed mind map about: {topic}
+
+Theme: {theme}
+Style: {style}
+Complexity: {complexity}
+
+Requirements:
+- Central concept in the middle
+- Main branches radiating outward with clear hierarchy
+- Sub-branches with related concepts
+- Use colors to differentiate categories
+- Include icons or small illustrations where relevant
+- Clean, organized layout with readable text
+- Professional and visually appealing design
+- Follow the {theme} color scheme
+- {style} visual style"""
+
+
+# Complexity label (first word) -> (main branches, sub-branches per branch) asked of the text model
+MINDMAP_TREE_SHAPES = {
+    "Simple": ("3-5", "2-3"),
+    "Moderate": ("5-7", "2-3"),
+    "Detailed": ("7-10", "2-4"),
+    "Comprehensive": ("10-12", "3-4"),
+}
+MAX_TREE_BRANCHES = 12
+MAX_TREE_CHILDREN = 5
+
+
+def build_mindmap_tree_prompt(topic, complexity, instructions=""):
+    branches, sub_branches = MINDMAP_TREE_SHAPES.get(complexity.split()[0], MINDMAP_TREE_SHAPES["Moderate"])
+    extra = f"\nAdditional instructions: {instructions}" if instructions else ""
+    return f"""Create the structure of a mind map tree about: {topic}
+
+Give the central concept, {branches} main branches, and {sub_branches} sub-branches under each main branch.
+Labels are short phrases (max 5 words) with no numbering.{extra}
+
+Respond with a single JSON object, like this:
+{{"title": "central concept", "children": [
+  {{"title": "main branch", "children": [{{"title": "sub-branch"}}, {{"title": "sub-branch"}}]}}
+]}}"""
+
+
+def build_slide_prompt(topic, slide_number, total_slides, slide_content, theme, style):
+    return f"""Create a professional presentation slide.
+
+Topic: {topic}
+Slide {slide_number} of {total_slides}
+Slide Content: {slide_content}
+
+Theme: {theme}
+Style: {style}
+
+Requirements:
+- Create a single, clean presentation slide
+- Include a clear title at the top
+- Use bullet points or key information in a readable layout
+- Professional typography and spacing
+- Follow the {theme} color scheme
+- {style} visual design
+- Include relevant icons or simple graphics if appropriate
+- Make text large and readable
+- This is slide {slide_number}, so {"make it an engaging title slide" if slide_number == 1 else "make it a content slide with key points" if slide_number < total_slides else "make it a conclusion/summary slide"}
+- DO NOT include any watermarks or attribution text"""
+
+
+def build_outline_prompt(topic, num_slides):
+    return f"""Create a brief outline for a {num_slides}-slide presentation about: {topic}
+
+For each slide, provide:
+- A short title (max 5 words)
+- 2-3 key bullet points (max 8 words each)
+
+Respond with a JSON array of exactly {num_slides} objects, one per slide in order, like this:
+[
+  {{"title": "title here", "points": ["point 1", "point 2", "point 3"]}}
+]
+
+Keep it concise and impactful."""
+
+
+def flight_key(prompt, aspect_ratio, image_size):
+    """Coalescing key: the request config plus the prompt with whitespace normalized"""
+    return cache_key(MODEL_ID, " ".join(prompt.split()), aspect_ratio, image_size)
+
+
+def slide_fingerprint(slide_request):
+    """Identity of a slide image: changes whenever its content, theme, style, size or aspect ratio do"""
+    prompt = build_slide_prompt(
+        slide_request["topic"], slide_request["slide_number"], slide_request["total_slides"],
+        slide_request["slide_content"], slide_request["theme"], slide_request["style"]
+    )
+    return flight_key(prompt, slide_request["aspect_ratio"], slide_request["image_size"])
+
+
+def request_image(api_key, prompt, aspect_ratio="16:9", image_size="4K", use_cache=True, cancel=None):
+    """Render prompt with the image model, serving identical requests from the image cache
+
+    With a cancel token, raises Cancelled once it is cancelled, without waiting for the API.
+    """
+    # A fresh render (use_cache=False) must not share a flight that may be answered from the cache
+    key = (flight_key(prompt, aspect_ratio, image_size), use_cache)
+    while True:
+        try:
+            image_data = image_flights.do(
+                key,
+                lambda: _fetch_image(api_key, prompt, aspect_ratio, image_size, use_cache, cancel),
+                cancel
+            )
+            break
+        except Cancelled:
+            if cancel is None or not cancel.cancelled:
+                # The caller leading this flight was cancelled, not this one: lead a new flight
+                continue
+            raise
+
+    # Keep the original bytes; decoding and re-encoding happen lazily, at most once.
+    # Every caller gets its own StoredImage even when the bytes came from a shared flight.
+    if image_data is not None:
+        return StoredImage(image_data)
+
+    return None
+
+
+def _fetch_image(api_key, prompt, aspect_ratio, image_size, use_cache, cancel=None):
+    """Raw image bytes from the cache or, on a miss, from the image model"""
+    image_cache = get_image_cache()
+    key = cache_key(MODEL_ID, prompt, aspect_ratio, image_size)
+    image_data = None
+    if use_cache:
+        with metrics.timer("cache_lookup"):
+            image_data = image_cache.get(key)
+        metrics.incr("cache_hits" if image_data is not None else "cache_misses")
+
+    if image_data is None:
+        from google.genai import types
+
+        metrics.incr("image_requests")
+        started = time.perf_counter()
+        try:
+            # Call the API through the shared scheduler (rate limiting, retries, hedging)
+            with get_client_manager().lease(api_key) as client:
+                response = get_scheduler().call(api_key, lambda: client.models.generate_content(
+                    model=MODEL_ID,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(
+                        response_modalities=["IMAGE"],
+                        image_config=types.ImageConfig(
+                            aspect_ratio=aspect_ratio,
+                            image_size=image_size
+                        )
+                    )
+                ), hedge=True, cancel=cancel)
+        except Cancelled:
+            raise
+        except Exception:
+            metrics.incr("image_errors")
+            raise
+        # Only completed calls count: planner.py reads this history, and an abandoned call says nothing about latency
+        metrics.observe(f"image_api_{image_size}", time.perf_counter() - started)
+
+        for part in response.candidates[0].content.parts:
+            if part.inline_data:
+                image_data = part.inline_data.data
+                metrics.incr("bytes_received", len(image_data))
+                with metrics.timer("cache_store"):
+                    image_cache.put(key, image_data)
+                break
+
+    return image_data
+
+
+def render_mindmap(topic, api_key, theme, style, complexity, aspect_ratio="16:9", image_size="4K", use_cache=True,
+                   cancel=None):
+    """Render a mind map, raising on errors so it can also run off the script thread"""
+    with metrics.timer("prompt"):
+        prompt = build_mindmap_prompt(topic, theme, style, complexity)
+    return request_image(api_key, prompt, aspect_ratio, image_size, use_cache, cancel)
+
+
+def render_slide(topic, slide_number, total_slides, slide_content, api_key, theme, style, aspect_ratio="16:9",
+                 image_size="4K", use_cache=True, cancel=None):
+    """Render a single presentation slide, raising on errors"""
+    with metrics.timer("prompt"):
+        prompt = build_slide_prompt(topic, slide_number, total_slides, slide_content, theme, style)
+    return request_image(api_key, prompt, aspect_ratio, image_size, use_cache, cancel)
+
+
+def render_slides(slide_requests, api_key, max_workers, on_slide_done=None, cancel=None):
+    """Render slides in parallel with at most max_workers requests in flight, keeping slide order
+
+    slide_requests may be a generator, e.g. one fed by stream_outline: each slide is submitted as
+    soon as it is produced, so rendering overlaps with whatever produces the rest. Once cancel is
+    cancelled, slides not yet started are dropped, in-flight ones stop waiting for the API, no
+    further callbacks run, and Cancelled is raised.
+    """
+    results = []
+    futures = {}
+    completed = 0
+
+    # Callbacks run on the calling thread, so Streamlit callers can update the page from them
+    def finish(future):
+        nonlocal completed
+        idx = futures.pop(future)
+        error = None
+        try:
+            results[idx] = future.result()
+        except Cancelled:
+            metrics.incr("slides_cancelled")
+            return
+        except Exception as e:
+            error = e
+        if cancel is not None and cancel.cancelled:
+            return
+        completed += 1
+        if on_slide_done:
+            on_slide_done(idx, results[idx], error, completed)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for idx, slide_request in enumerate(slide_requests):
+            if cancel is not None and cancel.cancelled:
+                break
+            results.append(None)
+            futures[executor.submit(render_slide, api_key=api_key, cancel=cancel, **slide_request)] = idx
+            # Report slides that finished while the producer was busy
+            for future in [future for future in futures if future.done()]:
+                finish(future)
+        for future in as_completed(list(futures)):
+            finish(future)
+
+    if cancel is not None:
+        cancel.check()
+    return results
+
+
+def generate_outline(topic, num_slides, api_key, cancel=None):
+    """Generate a structured content outline (title + points per slide), raising on errors"""
+    from google.genai import types
+
+    with metrics.timer("prompt"):
+        prompt = build_outline_prompt(topic, num_slides)
+    metrics.incr("outline_requests")
+    started = time.perf_counter()
+    try:
+        with get_client_manager().lease(api_key) as client:
+            response = get_scheduler().call(api_key, lambda: client.models.generate_content(
+                model=OUTLINE_MODEL_ID,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json"
+                )
+            ), cancel=cancel)
+    except Cancelled:
+        raise
+    except Exception:
+        metrics.incr("outline_errors")
+        raise
+    metrics.observe("outline_api", time.perf_counter() - started)
+    with metrics.timer("outline_parse"):
+        return parse_outline(response.text, num_slides)
+
+
+def stream_outline(topic, num_slides, api_key, cancel=None):
+    """Generate the outline like generate_outline, yielding each slide's entry as soon as it is complete
+
+    The response is streamed and parsed as it arrives, so callers can start rendering slide 1
+    while later slides are still being written. Raises like generate_outline; entries already
+    yielded stay valid. Once cancel is cancelled, the stream is dropped at the next chunk.
+    """
+    from google.genai import types
+
+    with metrics.timer("prompt"):
+        prompt = build_outline_prompt(topic, num_slides)
+    metrics.incr("outline_requests")
+    started = time.perf_counter()
+    parser = OutlineStreamParser()
+    count = 0
+    try:
+        with get_client_manager().lease(api_key) as client:
+            # Retries cover opening the stream, up to its first chunk; a stream that breaks later raises
+            chunks, stream = get_scheduler().call(api_key, lambda: _open_stream(client.models.generate_content_stream(
+                model=OUTLINE_MODEL_ID,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json"
+                )
+            )), cancel=cancel)
+            try:
+                for entry in parser.entries(_checked((chunk.text or "" for chunk in chunks), cancel)):
+                    if count == 0:
+                        metrics.observe("outline_first_slide", time.perf_counter() - started)
+                    yield entry
+                    count += 1
+                    if count == num_slides:
+                        break
+            finally:
+                # Stopping early (enough slides, cancelled, or the caller gave up) must not leave the response open
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+    except Cancelled:
+        metrics.incr("outline_cancelled")
+        raise
+    except Exception:
+        metrics.incr("outline_errors")
+        raise
+    metrics.observe("outline_api", time.perf_counter() - started)
+
+
+def _checked(texts, cancel):
+    """Pass texts through, raising Cancelled before the next one once cancel is cancelled"""
+    for text in texts:
+        if cancel is not None:
+            cancel.check()
+        yield text
+
+
+def _open_stream(stream):
+    """Pull the first chunk so connection and rate-limit errors surface inside the scheduler's retries
+
+    Returns the chunks from the first on, and the stream itself so it can be closed.
+    """
+    first = next(stream, None)
+    return itertools.chain([first] if first is not None else [], stream), stream
+
+
+class OutlineStreamParser:
+    """Incremental parser for a streamed JSON outline: returns each slide object once it is complete"""
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._text = []
+        self._in_array = False
+        self._emitted = 0
+
+    def feed(self, text):
+        """Add a chunk of response text; returns the outline entries it completed"""
+        self._text.append(text)
+        self._buffer += text
+        if not self._in_array:
+            # Skip anything before the array, e.g. a {"slides": wrapper
+            start = self._buffer.find("[")
+            if start < 0:
+                return []
+            self._buffer = self._buffer[start + 1:]
+            self._in_array = True
+
+        entries = []
+        while True:
+            self._buffer = self._buffer.lstrip(" \t\r\n,")
+            if not self._buffer or self._buffer[0] == "]":
+                break
+            try:
+                item, end = self._decoder.raw_decode(self._buffer)
+            except ValueError:
+                # The object is still incomplete
+                break
+            self._buffer = self._buffer[end:]
+            entry = _outline_entry(item)
+            if entry is not None:
+                entries.append(entry)
+        self._emitted += len(entries)
+        return entries
+
+    def entries(self, texts):
+        """Every entry of a response arriving as texts, each as soon as its object is complete"""
+        for text in texts:
+            yield from self.feed(text)
+        yield from self.close()
+
+    def close(self):
+        """Entries the incremental pass could not split out, recovered by parsing the whole response"""
+        remainder = self._buffer.strip()
+        if self._in_array and (not remainder or remainder.startswith("]")):
+            return []
+        return parse_outline("".join(self._text), None)[self._emitted:]
+
+
+def parse_outline(outline_text, num_slides):
+    """Parse the JSON outline into one {"title", "points"} dict per slide"""
+    data = json.loads(outline_text)
+    if isinstance(data, dict):
+        data = data.get("slides", [])
+
+    entries = (_outline_entry(item) for item in data[:num_slides])
+    return [entry for entry in entries if entry is not None]
+
+
+def _outline_entry(item):
+    """One slide's {"title", "points"}, or None for anything that is not a slide object"""
+    if not isinstance(item, dict):
+        return None
+    points = item.get("points") or []
+    if isinstance(points, str):
+        points = points.split("|")
+    return {
+        "title": str(item.get("title", "")).strip(),
+        "points": [str(point).strip() for point in points if str(point).strip()]
+    }
+
+
+def generate_mindmap_tree(topic, complexity, api_key, instructions="", cancel=None):
+    """Generate a mind map as a JSON concept tree with the text model, raising on errors"""
+    from google.genai import types
+
+    with metrics.timer("prompt"):
+        prompt = build_mindmap_tree_prompt(topic, complexity, instructions)
+    metrics.incr("mindmap_tree_requests")
+    try:
+        with get_client_manager().lease(api_key) as client, metrics.timer("mindmap_tree_api"):
+            response = get_scheduler().call(api_key, lambda: client.models.generate_content(
+                model=OUTLINE_MODEL_ID,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json"
+                )
+            ), cancel=cancel)
+    except Cancelled:
+        raise
+    except Exception:
+        metrics.incr("mindmap_tree_errors")
+        raise
+    with metrics.timer("mindmap_tree_parse"):
+        return parse_mindmap_tree(response.text, topic)
+
+
+def parse_mindmap_tree(tree_text, topic):
+    """Parse the JSON tree into {"title", "children"} nodes, at most three levels deep and bounded in width"""
+    data = json.loads(tree_text)
+    if isinstance(data, list):
+        data = {"title": topic, "children": data}
+
+    def node(item, depth):
+        if isinstance(item, str):
+            item = {"title": item}
+        if not isinstance(item, dict):
+            return None
+        title = str(item.get("title") or item.get("label") or item.get("name") or "").strip()
+        if not title:
+            return None
+        children = item.get("children") or item.get("branches") or []
+        if depth >= 2 or not isinstance(children, list):
+            children = []
+        limit = MAX_TREE_BRANCHES if depth == 0 else MAX_TREE_CHILDREN
+        parsed = [child for child in (node(child, depth + 1) for child in children) if child][:limit]
+        return {"title": title, "children": parsed}
+
+    tree = node(data, 0) if isinstance(data, dict) else None
+    if tree is None or not tree["children"]:
+        raise ValueError("the model returned an empty mind map")
+    return tree
+
+
+def format_slide_content(slide_outline):
+    """Render one slide's outline entry as the content passed to the image model"""
+    return f"Title: {slide_outline['title']}\nPoints: {' | '.join(slide_outline['points'])}"
+
+
+def build_slide_requests(topic, num_slides, content_outline, theme, style, aspect_ratio="16:9",
+                         image_size="4K", custom_instructions="", use_cache=True):
+    """Keyword arguments for render_slide, one dict per slide; each slide only gets its own outline entry"""
+    slide_requests = []
+    for i in range(num_slides):
+        slide_num = i + 1
+
+        if content_outline and i < len(content_outline):
+            slide_content = format_slide_content(content_outline[i])
+        else:
+            slide_content = f"Slide {slide_num} about {topic}"
+
+        if custom_instructions:
+            slide_content += f". Additional requirements: {custom_instructions}"
+
+        slide_requests.append(dict(
+            topic=topic,
+            slide_number=slide_num,
+            total_slides=num_slides,
+            slide_content=slide_content,
+            theme=theme,
+            style=style,
+            aspect_ratio=aspect_ratio,
+            image_size=image_size,
+            use_cache=use_cache
+        ))
+    return slide_requests
+
+
+def write_image(job_dir, stem, stored_image):
+    """Write a StoredImage to job_dir as <stem>.<extension>, atomically; returns the file name"""
+    file_name = f"{stem}.{EXTENSIONS.get(stored_image.mime_type, 'png')}"
+    tmp_path = os.path.join(job_dir, f".{file_name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(stored_image.data)
+    os.replace(tmp_path, os.path.join(job_dir, file_name))
+    return file_name
@@ -0,0 +1,329 @@
+"""Deck export: streams slides one at a time through a process pool into a ZIP, PDF or PPTX
+
+Slides are loaded, encoded and appended to the output as they come, with at most EXPORT_WORKERS
+of them in memory at once. The output goes to a spooled temporary file that moves to disk once it
+outgrows BANANA_EXPORT_SPOOL_MB (default 32), so neither the slides nor the finished file have to
+fit in RAM.
+"""
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from metrics import metrics
+
+EXPORT_WORKERS = int(os.environ.get("BANANA_EXPORT_WORKERS", min(os.cpu_count() or 1, 4)))
+SPOOL_MAX_BYTES = int(os.environ.get("BANANA_EXPORT_SPOOL_MB", "32")) * 1024 * 1024
+
+# Page width of exported PDFs in points (13.33in, the standard widescreen slide width)
+PDF_PAGE_WIDTH = 960
+# The same width in EMU, the unit of PPTX geometry
+PPTX_SLIDE_WIDTH = 12192000
+
+# Label -> (encoding, container, mime type, file extension)
+EXPORT_FORMATS = {
+    "PNG (ZIP)": ("PNG", "zip", "application/zip", "zip"),
+    "WebP (ZIP)": ("WEBP", "zip", "application/zip", "zip"),
+    "PDF": ("JPEG", "pdf", "application/pdf", "pdf"),
+    "PowerPoint (PPTX)": ("PNG", "pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation", "pptx"),
+}
+
+SOURCE_FORMATS = {"image/png": "PNG", "image/jpeg": "JPEG", "image/webp": "WEBP"}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_export_pool():
+    """Process-wide encoder pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the Streamlit server is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def encode_image(data, encoding):
+    """Re-encode raw image bytes; returns (bytes, width, height). Runs in the pool workers."""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    if encoding in ("JPEG", "WEBP") and img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    if encoding == "JPEG":
+        img.save(buffer, format="JPEG", quality=90, optimize=True)
+    elif encoding == "WEBP":
+        img.save(buffer, format="WEBP", quality=90, method=4)
+    else:
+        img.save(buffer, format=encoding)
+    return buffer.getvalue(), img.width, img.height
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _encode_stream(sources, encoding):
+    """Yield (position, (bytes, width, height)) per slide in order, with at most EXPORT_WORKERS slides loaded at a time
+
+    sources are StoredImages, zero-argument callables returning one, or None, one per slide
+    position, so slides can stay on disk until their turn. Missing slides are skipped but keep
+    their position. Slides already in the target format pass through untouched.
+    """
+    window = deque()
+    for position, source in enumerate(sources):
+        stored_image = source() if callable(source) else source
+        if stored_image is None:
+            # Never rendered, or evicted from its store since the export was requested
+            continue
+        # Image.open only parses the header here, so checking size and mode does not decode pixels
+        passthrough = SOURCE_FORMATS.get(stored_image.mime_type) == encoding
+        if passthrough and (encoding != "JPEG" or stored_image.image.mode == "RGB"):
+            window.append((position, _done((stored_image.data, *stored_image.size))))
+        else:
+            window.append((position, get_export_pool().submit(encode_image, stored_image.data, encoding)))
+        del stored_image
+        while len(window) >= EXPORT_WORKERS:
+            position, future = window.popleft()
+            yield position, future.result()
+    while window:
+        position, future = window.popleft()
+        yield position, future.result()
+
+
+def write_zip(named_files, fp):
+    """Write (file name, bytes) pairs uncompressed; image formats are already compressed"""
+    with zipfile.ZipFile(fp, "w", zipfile.ZIP_STORED) as zip_file:
+        for file_name, data in named_files:
+            zip_file.writestr(file_name, data)
+
+
+def write_pdf(pages, fp, page_width=PDF_PAGE_WIDTH):
+    """Write (jpeg bytes, width, height) pages as a PDF, embedding the JPEGs without re-encoding"""
+    offsets = {}
+
+    def begin_object(number):
+        offsets[number] = fp.tell()
+        fp.write(f"{number} 0 obj\n".encode())
+
+    fp.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    # Objects 1 and 2 (catalog and page tree) are written last, once every page is known
+    kids = []
+    next_number = 3
+    for jpeg, width, height in pages:
+        page_number, image_number, content_number = next_number, next_number + 1, next_number + 2
+        next_number += 3
+        page_height = page_width * height / width
+
+        begin_object(image_number)
+        fp.write(
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>\nstream\n".encode()
+        )
+        fp.write(jpeg)
+        fp.write(b"\nendstream\nendobj\n")
+
+        content = f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q".encode()
+        begin_object(content_number)
+        fp.write(f"<< /Length {len(content)} >>\nstream\n".encode())
+        fp.write(content)
+        fp.write(b"\nendstream\nendobj\n")
+
+        begin_object(page_number)
+        fp.write(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_number} 0 R >> >> /Contents {content_number} 0 R >>\nendobj\n".encode()
+        )
+        kids.append(page_number)
+
+    begin_object(2)
+    fp.write(f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>\nendobj\n".encode())
+    begin_object(1)
+    fp.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+
+    xref_offset = fp.tell()
+    fp.write(f"xref\n0 {next_number}\n0000000000 65535 f \n".encode())
+    for number in range(1, next_number):
+        fp.write(f"{offsets[number]:010d} 00000 n \n".encode())
+    fp.write(f"trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+PPTX_NAMESPACES = (
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"'
+)
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+REL_BASE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+EMPTY_SHAPE_TREE = (
+    '<p:spTree><p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr>'
+    '<p:grpSpPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="0" cy="0"/>'
+    '<a:chOff x="0" y="0"/><a:chExt cx="0" cy="0"/></a:xfrm></p:grpSpPr>'
+)
+
+
+def _relationships(targets):
+    """A .rels part for (type, target) pairs, numbered rId1, rId2, ..."""
+    rels = "".join(
+        f'<Relationship Id="rId{number}" Type="{REL_BASE}/{rel_type}" Target="{target}"/>'
+        for number, (rel_type, target) in enumerate(targets, start=1)
+    )
+    return (
+        f'{XML_HEADER}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'{rels}</Relationships>'
+    )
+
+
+def _pptx_theme():
+    colors = "".join(
+        f"<a:{name}><a:srgbClr val=\"{value}\"/></a:{name}>"
+        for name, value in (("dk2", "1F497D"), ("lt2", "EEECE1"), ("accent1", "4F81BD"), ("accent2", "C0504D"),
+                            ("accent3", "9BBB59"), ("accent4", "8064A2"), ("accent5", "4BACC6"), ("accent6", "F79646"),
+                            ("hlink", "0000FF"), ("folHlink", "800080"))
+    )
+    font = '<a:latin typeface="Calibri"/><a:ea typeface=""/><a:cs typeface=""/>'
+    fill = '<a:solidFill><a:schemeClr val="phClr"/></a:solidFill>'
+    line = f'<a:ln w="9525">{fill}</a:ln>'
+    return (
+        f'{XML_HEADER}<a:theme xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" name="Office Theme">'
+        f'<a:themeElements>'
+        f'<a:clrScheme name="Office"><a:dk1><a:sysClr val="windowText" lastClr="000000"/></a:dk1>'
+        f'<a:lt1><a:sysClr val="window" lastClr="FFFFFF"/></a:lt1>{colors}</a:clrScheme>'
+        f'<a:fontScheme name="Office"><a:majorFont>{font}</a:majorFont><a:minorFont>{font}</a:minorFont></a:fontScheme>'
+        f'<a:fmtScheme name="Office"><a:fillStyleLst>{fill * 3}</a:fillStyleLst>'
+        f'<a:lnStyleLst>{line * 3}</a:lnStyleLst>'
+        f'<a:effectStyleLst>{"<a:effectStyle><a:effectLst/></a:effectStyle>" * 3}</a:effectStyleLst>'
+        f'<a:bgFillStyleLst>{fill * 3}</a:bgFillStyleLst></a:fmtScheme>'
+        f'</a:themeElements></a:theme>'
+    )
+
+
+def write_pptx(pages, fp, file_stem="slide", slide_width=PPTX_SLIDE_WIDTH):
+    """Write (png bytes, width, height) pages as a PowerPoint deck, one full-bleed picture per slide
+
+    Each picture is appended to the package as it arrives; the parts that list every slide are
+    written last. The slide size follows the first page's aspect ratio.
+    """
+    slide_height = None
+    count = 0
+    with zipfile.ZipFile(fp, "w", zipfile.ZIP_DEFLATED) as pptx:
+        for count, (png, width, height) in enumerate(pages, start=1):
+            if slide_height is None:
+                slide_height = round(slide_width * height / width)
+            # Fit the picture inside the slide, centred, in case later pages have another aspect ratio
+            scale = min(slide_width / width, slide_height / height)
+            cx, cy = round(width * scale), round(height * scale)
+            pptx.writestr(zipfile.ZipInfo(f"ppt/media/image{count}.png"), png, compress_type=zipfile.ZIP_STORED)
+            pptx.writestr(f"ppt/slides/slide{count}.xml", (
+                f'{XML_HEADER}<p:sld {PPTX_NAMESPACES}><p:cSld>{EMPTY_SHAPE_TREE}'
+                f'<p:pic><p:nvPicPr><p:cNvPr id="2" name="{escape(file_stem)} {count}"/>'
+                f'<p:cNvPicPr><a:picLocks noChangeAspect="1"/></p:cNvPicPr><p:nvPr/></p:nvPicPr>'
+                f'<p:blipFill><a:blip r:embed="rId2"/><a:stretch><a:fillRect/></a:stretch></p:blipFill>'
+                f'<p:spPr><a:xfrm><a:off x="{(slide_width - cx) // 2}" y="{(slide_height - cy) // 2}"/>'
+                f'<a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+                f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></p:spPr></p:pic>'
+                f'</p:spTree></p:cSld><p:clrMapOvr><a:masterClrMapping/></p:clrMapOvr></p:sld>'
+            ))
+            pptx.writestr(f"ppt/slides/_rels/slide{count}.xml.rels", _relationships([
+                ("slideLayout", "../slideLayouts/slideLayout1.xml"),
+                ("image", f"../media/image{count}.png"),
+            ]))
+
+        slide_height = slide_height or round(slide_width * 9 / 16)
+        slide_ids = "".join(f'<p:sldId id="{255 + number}" r:id="rId{number + 2}"/>' for number in range(1, count + 1))
+        slide_types = "".join(
+            f'<Override PartName="/ppt/slides/slide{number}.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/>'
+            for number in range(1, count + 1)
+        )
+        pptx.writestr("[Content_Types].xml", (
+            f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            f'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            f'<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Default Extension="png" ContentType="image/png"/>'
+            f'<Override PartName="/ppt/presentation.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml"/>'
+            f'<Override PartName="/ppt/slideMasters/slideMaster1.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.presentationml.slideMaster+xml"/>'
+            f'<Override PartName="/ppt/slideLayouts/slideLayout1.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.presentationml.slideLayout+xml"/>'
+            f'<Override PartName="/ppt/theme/theme1.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.theme+xml"/>'
+            f'{slide_types}</Types>'
+        ))
+        pptx.writestr("_rels/.rels", _relationships([("officeDocument", "ppt/presentation.xml")]))
+        pptx.writestr("ppt/presentation.xml", (
+            f'{XML_HEADER}<p:presentation {PPTX_NAMESPACES}>'
+            f'<p:sldMasterIdLst><p:sldMasterId id="2147483648" r:id="rId1"/></p:sldMasterIdLst>'
+            f'<p:sldIdLst>{slide_ids}</p:sldIdLst>'
+            f'<p:sldSz cx="{slide_width}" cy="{slide_height}"/><p:notesSz cx="6858000" cy="9144000"/>'
+            f'</p:presentation>'
+        ))
+        pptx.writestr("ppt/_rels/presentation.xml.rels", _relationships(
+            [("slideMaster", "slideMasters/slideMaster1.xml"), ("theme", "theme/theme1.xml")]
+            + [("slide", f"slides/slide{number}.xml") for number in range(1, count + 1)]
+        ))
+        pptx.writestr("ppt/slideMasters/slideMaster1.xml", (
+            f'{XML_HEADER}<p:sldMaster {PPTX_NAMESPACES}><p:cSld>{EMPTY_SHAPE_TREE}</p:spTree></p:cSld>'
+            f'<p:clrMap bg1="lt1" tx1="dk1" bg2="lt2" tx2="dk2" accent1="accent1" accent2="accent2" accent3="accent3" '
+            f'accent4="accent4" accent5="accent5" accent6="accent6" hlink="hlink" folHlink="folHlink"/>'
+            f'<p:sldLayoutIdLst><p:sldLayoutId id="2147483649" r:id="rId1"/></p:sldLayoutIdLst></p:sldMaster>'
+        ))
+        pptx.writestr("ppt/slideMasters/_rels/slideMaster1.xml.rels", _relationships([
+            ("slideLayout", "../slideLayouts/slideLayout1.xml"),
+            ("theme", "../theme/theme1.xml"),
+        ]))
+        pptx.writestr("ppt/slideLayouts/slideLayout1.xml", (
+            f'{XML_HEADER}<p:sldLayout {PPTX_NAMESPACES} type="blank" preserve="1">'
+            f'<p:cSld name="Blank">{EMPTY_SHAPE_TREE}</p:spTree></p:cSld>'
+            f'<p:clrMapOvr><a:masterClrMapping/></p:clrMapOvr></p:sldLayout>'
+        ))
+        pptx.writestr("ppt/slideLayouts/_rels/slideLayout1.xml.rels", _relationships([
+            ("slideMaster", "../slideMasters/slideMaster1.xml"),
+        ]))
+        pptx.writestr("ppt/theme/theme1.xml", _pptx_theme())
+
+
+def export_deck_file(sources, export_format, file_stem="slide"):
+    """Export slides in one of EXPORT_FORMATS to a spooled temporary file; returns (file, mime type, file extension)
+
+    sources are StoredImages, zero-argument callables returning one, or None for a missing slide,
+    one per slide position; they are loaded one at a time, in order. ZIP members are named after
+    the slide's position, so a missing slide leaves a gap rather than renumbering the rest. The
+    returned file is positioned at its start and owned by the caller.
+    """
+    encoding, container, mime_type, extension = EXPORT_FORMATS[export_format]
+    numbered_pages = _encode_stream(sources, encoding)
+    fp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    with metrics.timer(f"export_{container}"):
+        if container == "pdf":
+            write_pdf((page for _, page in numbered_pages), fp)
+        elif container == "pptx":
+            write_pptx((page for _, page in numbered_pages), fp, file_stem)
+        else:
+            suffix = encoding.lower()
+            write_zip(
+                ((f"{file_stem}_{position + 1}.{suffix}", data) for position, (data, _, _) in numbered_pages), fp
+            )
+    metrics.incr("export_bytes", fp.tell())
+    fp.seek(0)
+    return fp, mime_type, extension
+
+
+def export_deck(sources, export_format, file_stem="slide"):
+    """Like export_deck_file, but returns (bytes, mime type, file extension)"""
+    fp, mime_type, extension = export_deck_file(sources, export_format, file_stem)
+    with fp:
+        return fp.read(), mime_type, extension
@@ -0,0 +1,261 @@
+"""Persistent, searchable history of every finished mind map and deck
+
+Images are stored once under the SHA-256 of their bytes, next to a display-size JPEG preview
+and a small thumbnail made when they are added, so the history page never decodes a full-size
+image to draw its grid or an entry, and reopening an old result costs no API call. A SQLite
+index holds the topic, settings and timestamps of each entry: full-text search goes through an
+FTS5 table (a LIKE scan where SQLite lacks FTS5), and pages are read newest first by keyset on
+(created, id), so a page costs the same however deep into tens of thousands of entries it is.
+Tuned with:
+
+    BANANA_GALLERY_DIR      where the index, images, previews and thumbnails are kept
+                            (default ~/.cache/nano-banana/gallery)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from image_store import StoredImage, make_preview
+from metrics import metrics
+
+GALLERY_DIR = os.environ.get("BANANA_GALLERY_DIR", os.path.join(os.path.expanduser("~"), ".cache", "nano-banana", "gallery"))
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_QUALITY = 80
+PAGE_SIZE = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT UNIQUE,
+    kind TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    theme TEXT,
+    style TEXT,
+    complexity TEXT,
+    size TEXT,
+    aspect_ratio TEXT,
+    created REAL NOT NULL,
+    added REAL NOT NULL,
+    cover TEXT,
+    image_count INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    outline TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_by_created ON entries (created DESC, id DESC);
+CREATE INDEX IF NOT EXISTS entries_by_kind ON entries (kind, created DESC, id DESC);
+CREATE TABLE IF NOT EXISTS images (
+    entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    PRIMARY KEY (entry_id, position)
+) WITHOUT ROWID;
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(topic, theme, style, content='entries', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, topic, theme, style) VALUES (new.id, new.topic, new.theme, new.style);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, topic, theme, style)
+    VALUES ('delete', old.id, old.topic, old.theme, old.style);
+END;
+"""
+
+# Columns the history grid needs; params and outline are only read when an entry is opened
+LIST_COLUMNS = "e.id, e.kind, e.topic, e.theme, e.style, e.size, e.aspect_ratio, e.created, e.cover, e.image_count"
+
+
+def fts_query(text):
+    """An FTS5 query matching entries that contain every word of text, each as a prefix"""
+    words = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class Gallery:
+    """SQLite index over content-addressed images and thumbnails; safe to share between threads"""
+
+    def __init__(self, directory=GALLERY_DIR):
+        self.directory = directory
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to scanning topics
+            self.full_text = False
+
+    def _connection(self):
+        """This thread's connection; sqlite3 connections must not be shared between threads"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(os.path.join(self.directory, "gallery.db"), timeout=30)
+            connection.row_factory = sqlite3.Row
+            # Readers (every history page) never wait for the job worker that is adding an entry
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def _path(self, kind, digest):
+        return os.path.join(self.directory, kind, digest[:2], digest)
+
+    def _read(self, kind, digest):
+        try:
+            with open(self._path(kind, digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, kind, digest, data):
+        path = self._path(kind, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _store(self, data):
+        """Write data, its preview and its thumbnail under their digest unless they are already there"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self._path("images", digest)):
+            self._write("images", digest, data)
+        if not os.path.exists(self._path("thumbnails", digest)):
+            # Downscaled from the preview rather than from the full-size image
+            self._write("thumbnails", digest, make_preview(self.preview(digest), THUMBNAIL_WIDTH, THUMBNAIL_QUALITY))
+        return digest
+
+    def add(self, params, images, outline=None, job_id=None, created=None):
+        """Record a finished generation; images maps position -> StoredImage. Returns the entry id
+
+        An entry already recorded for job_id is returned as is.
+        """
+        with metrics.timer("gallery_add"):
+            if job_id is not None:
+                existing = self._connection().execute("SELECT id FROM entries WHERE job_id = ?", (job_id,)).fetchone()
+                if existing is not None:
+                    return existing["id"]
+            stored = [(idx, self._store(image.data), image.mime_type) for idx, image in sorted(images.items())]
+            connection = self._connection()
+            with self._write_lock, connection:
+                cursor = connection.execute(
+                    "INSERT INTO entries (job_id, kind, topic, theme, style, complexity, size, aspect_ratio, "
+                    "created, added, cover, image_count, params, outline) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job_id, params["kind"], params["topic"], params.get("theme"), params.get("style"),
+                        params.get("complexity"), params.get("size"), params.get("aspect_ratio"),
+                        created or time.time(), time.time(),
+                        stored[0][1] if stored else None, len(stored), json.dumps(params, ensure_ascii=False),
+                        None if outline is None else json.dumps(outline, ensure_ascii=False),
+                    ),
+                )
+                connection.executemany(
+                    "INSERT INTO images (entry_id, position, digest, mime_type) VALUES (?, ?, ?, ?)",
+                    [(cursor.lastrowid, idx, digest, mime_type) for idx, digest, mime_type in stored],
+                )
+            metrics.incr("gallery_entries_added")
+            return cursor.lastrowid
+
+    def page(self, query="", kind=None, after=None, limit=PAGE_SIZE):
+        """Up to limit entries newest first, plus the cursor for the next page (None on the last page)
+
+        query matches topic, theme and style words by prefix; kind is "mindmap" or "slides";
+        after is the cursor returned with the previous page.
+        """
+        clauses, args = [], []
+        source = "entries e"
+        if query.strip():
+            if self.full_text:
+                # CROSS JOIN keeps the match set as the outer loop; otherwise SQLite may walk the kind
+                # index and probe the full-text table once per row
+                source = "entries_fts CROSS JOIN entries e ON e.id = entries_fts.rowid"
+                clauses.append("entries_fts MATCH ?")
+                args.append(fts_query(query))
+            else:
+                clauses.append("e.topic LIKE ?")
+                args.append(f"%{query.strip()}%")
+        if kind:
+            clauses.append("e.kind = ?")
+            args.append(kind)
+        if after is not None:
+            clauses.append("(e.created, e.id) < (?, ?)")
+            args.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with metrics.timer("gallery_page"):
+            rows = self._connection().execute(
+                f"SELECT {LIST_COLUMNS} FROM {source} {where} ORDER BY e.created DESC, e.id DESC LIMIT ?",
+                (*args, limit + 1),
+            ).fetchall()
+        entries = [dict(row) for row in rows[:limit]]
+        cursor = (entries[-1]["created"], entries[-1]["id"]) if len(rows) > limit else None
+        return entries, cursor
+
+    def entry(self, entry_id):
+        """The full entry (params, outline and its images' positions, digests and mime types), or None"""
+        connection = self._connection()
+        row = connection.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["params"] = json.loads(entry["params"])
+        entry["outline"] = None if entry["outline"] is None else json.loads(entry["outline"])
+        entry["images"] = [
+            dict(image)
+            for image in connection.execute(
+                "SELECT position, digest, mime_type FROM images WHERE entry_id = ? ORDER BY position", (entry_id,)
+            )
+        ]
+        return entry
+
+    def image(self, digest, mime_type=None):
+        """The stored image with this digest, or None if its file is gone"""
+        data = self._read("images", digest)
+        return None if data is None else StoredImage(data, mime_type)
+
+    def preview(self, digest):
+        """Display-size JPEG bytes for the image with this digest, or None if it is gone
+
+        Entries recorded before previews were kept get theirs made and stored on first view.
+        """
+        preview = self._read("previews", digest)
+        if preview is None:
+            data = self._read("images", digest)
+            if data is None:
+                return None
+            with metrics.timer("preview"):
+                preview = make_preview(data)
+            self._write("previews", digest, preview)
+        return preview
+
+    def thumbnail(self, digest):
+        """JPEG thumbnail bytes for the image with this digest, or None"""
+        return self._read("thumbnails", digest)
+
+    def count(self):
+        return self._connection().execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        return {"entries": self.count(), "full_text": self.full_text}
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    """The gallery shared by every session in this process"""
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = Gallery()
+            metrics.register_collector("gallery", _gallery.stats)
+        return _gallery
@@ -0,0 +1,123 @@
+"""Encode-once holders for generated images, so Streamlit reruns never re-encode pixels"""
+import io
+
+from metrics import metrics
+
+MIME_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"RIFF", "image/webp"),
+    (b"GIF8", "image/gif"),
+]
+
+# Streamlit's maximum content width: st.image passes narrower JPEGs through without re-encoding
+PREVIEW_MAX_WIDTH = 1460
+PREVIEW_QUALITY = 85
+
+
+def sniff_mime_type(data):
+    """Guess the image mime type from its magic bytes"""
+    for signature, mime_type in MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    return "application/octet-stream"
+
+
+def _to_rgb(img):
+    """img as RGB, with any transparency composited onto white"""
+    from PIL import Image
+
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA", "PA", "RGBa", "La"):
+        img = img.convert("RGBA")
+        flattened = Image.new("RGB", img.size, "white")
+        flattened.paste(img, mask=img.getchannel("A"))
+        return flattened
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
+
+
+def make_preview(data, max_width=PREVIEW_MAX_WIDTH, quality=PREVIEW_QUALITY):
+    """Downscale image bytes to a width-capped JPEG, decoding as few pixels as possible"""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    if img.width <= max_width and img.format == "JPEG":
+        return data
+
+    target_size = (min(max_width, img.width), round(img.height * min(max_width, img.width) / img.width))
+    # JPEG sources decode straight at a reduced scale; for other formats this is a no-op
+    img.draft("RGB", target_size)
+    # reduce() only takes 8-bit modes: palette, 1-bit and 16-bit images are converted before it
+    img = _to_rgb(img)
+    # Cheap integer box reduction first, then a quality resample for the remainder
+    factor = img.width // target_size[0]
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != target_size:
+        img = img.resize(target_size, Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class StoredImage:
+    """The original inline_data bytes plus lazily built, memoized derived artifacts"""
+
+    def __init__(self, data, mime_type=None, preview=None):
+        self.data = data
+        self.mime_type = mime_type or sniff_mime_type(data)
+        self._image = None
+        self._png = None
+        # preview: a PREVIEW_MAX_WIDTH preview made earlier, e.g. read back from disk
+        self._previews = {PREVIEW_MAX_WIDTH: preview} if preview is not None else {}
+
+    @property
+    def image(self):
+        """Lazily opened PIL image; only the header is read until pixels are accessed"""
+        if self._image is None:
+            from PIL import Image
+
+            with metrics.timer("image_open"):
+                self._image = Image.open(io.BytesIO(self.data))
+        return self._image
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def png_bytes(self):
+        """PNG encoding of the image; the original bytes when the model already returned PNG"""
+        if self.mime_type == "image/png":
+            return self.data
+        if self._png is None:
+            from PIL import Image
+
+            with metrics.timer("png_encode"):
+                # Decode into a throwaway image so the full-resolution pixels are not kept alive
+                buffer = io.BytesIO()
+                Image.open(io.BytesIO(self.data)).save(buffer, format="PNG")
+                self._png = buffer.getvalue()
+        return self._png
+
+    def preview_bytes(self, max_width=PREVIEW_MAX_WIDTH):
+        """Width-capped JPEG for on-page display; full resolution is only served by downloads"""
+        if max_width not in self._previews:
+            with metrics.timer("preview"):
+                self._previews[max_width] = make_preview(self.data, max_width)
+        return self._previews[max_width]
+
+    def nbytes(self):
+        """Bytes held by this object: source data plus memoized encodings (decoded pixels are not kept)"""
+        return len(self.data) + len(self._png or b"") + sum(len(preview) for preview in self._previews.values())
+
+    def __getstate__(self):
+        # Only the source bytes are worth keeping; everything else is cheap to rebuild
+        return {"data": self.data, "mime_type": self.mime_type}
+
+    def __setstate__(self, state):
+        self.__init__(state["data"], state["mime_type"])
+
@@ -0,0 +1,531 @@
+"""Background generation jobs that outlive the Streamlit script run that submitted them
+
+Progress and every finished image are written to <BANANA_JOBS_DIR>/<job id>/ as they arrive, so
+a page can poll a job and a refreshed browser can reattach to it by id. Tuned with:
+
+    BANANA_JOBS_DIR                 where job state and images are kept (default ~/.cache/nano-banana/jobs)
+    BANANA_JOB_WORKERS              jobs rendering at the same time (default 4)
+    BANANA_MAX_JOBS                 jobs queued or running per process before submissions are refused (default 16)
+    BANANA_JOB_RETENTION_HOURS      finished jobs older than this are deleted (default 24)
+    BANANA_JOB_ABANDON_SECONDS      jobs whose session closed this long ago are cancelled; 0 never (default 120)
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cancellation import Cancelled, CancelToken
+from core import (
+    JOB_DEFAULTS, build_slide_requests, generate_mindmap_tree, render_mindmap, render_slides, slide_fingerprint,
+    stream_outline, write_image
+)
+from gallery import get_gallery
+from image_store import StoredImage
+from metrics import metrics
+from planner import plan_deck, plan_upgrades
+
+JOBS_DIR = os.environ.get("BANANA_JOBS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "nano-banana", "jobs"))
+JOB_WORKERS = int(os.environ.get("BANANA_JOB_WORKERS", "4"))
+MAX_JOBS_IN_FLIGHT = int(os.environ.get("BANANA_MAX_JOBS", "16"))
+RETENTION_SECONDS = float(os.environ.get("BANANA_JOB_RETENTION_HOURS", "24")) * 3600
+ABANDON_SECONDS = float(os.environ.get("BANANA_JOB_ABANDON_SECONDS", "120"))
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{16}")
+FINISHED = ("done", "failed", "interrupted", "cancelled")
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when the process already has its maximum number of jobs queued or running"""
+
+
+class Job:
+    """State of one job; the worker mutates it and every change is persisted to job.json"""
+
+    def __init__(self, id, params, status="queued", created=None, outline=None, outline_error=None,
+                 files=None, fingerprints=None, errors=None, upgrade_errors=None, error=None, completed=0, seconds=None,
+                 plan=None):
+        self.id = id
+        self.params = params
+        self.status = status
+        self.created = created or time.time()
+        # An outline given in params (e.g. edited by the user) is used instead of generating one;
+        # for a locally rendered mind map, the outline is its concept tree
+        self.outline = outline if outline is not None else params.get("outline")
+        self.outline_error = outline_error
+        self.total = 1 if params["kind"] == "mindmap" else int(params["num_slides"])
+        self.files = files or [None] * self.total
+        # slide_fingerprint of the full-size request behind each file; None for drafts
+        self.fingerprints = fingerprints or [None] * self.total
+        # Per-image failures keyed by position; error is set when the whole job failed
+        self.errors = {int(idx): message for idx, message in (errors or {}).items()}
+        # Full-size renders that failed; those positions keep their draft
+        self.upgrade_errors = {int(idx): message for idx, message in (upgrade_errors or {}).items()}
+        self.error = error
+        self.completed = completed
+        self.seconds = seconds
+        # planner.plan_deck's decisions for a deck with a deadline, plus the outcome once finished
+        self.plan = plan
+        self.directory = None
+        # Only meaningful while the job is in this process's queue: the Streamlit session following
+        # the job, and since when that session has been gone
+        self.cancel_token = CancelToken()
+        self.owner = None
+        self.orphaned = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    @property
+    def rendering(self):
+        """Whether some positions may still get their first image"""
+        return self.status in ("queued", "running")
+
+    @property
+    def render_size(self):
+        """Size the job renders at: a fast draft size, or the requested size itself"""
+        return self.params.get("draft_size") or self.params["size"]
+
+    @property
+    def slide_workers(self):
+        """Slide requests in flight at once: the planner's choice under a deadline, else the requested number"""
+        return self.plan["concurrency"] if self.plan else self.params["slide_workers"]
+
+    def target_size(self, idx):
+        """Size slide idx should end up at: the planner's choice under a deadline, else the requested size"""
+        if self.plan:
+            return self.plan["sizes"].get(str(idx), self.params["size"])
+        return self.params["size"]
+
+    def first_size(self, idx):
+        """Size slide idx is rendered at first: the draft size where drafts come first, else its target size"""
+        draft_size = self.plan["draft_size"] if self.plan else self.params.get("draft_size")
+        return draft_size or self.target_size(idx)
+
+    def image(self, idx):
+        """The StoredImage at position idx, or None if it has not been rendered (yet)"""
+        if self.files[idx] is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, self.files[idx]), "rb") as f:
+                return StoredImage(f.read())
+        except OSError:
+            # Replaced by its full-size render since this state was read
+            return None
+
+    def slide_requests(self, image_size=None):
+        """render_slide keyword arguments for every slide, at the requested size unless image_size is given"""
+        params = self.params
+        return build_slide_requests(
+            params["topic"], self.total, self.outline, params["theme"], params["style"],
+            params["aspect_ratio"], image_size or params["size"], params["instructions"], params["use_cache"]
+        )
+
+    def wanted_fingerprints(self):
+        return [slide_fingerprint(slide_request) for slide_request in self.slide_requests()]
+
+    def reusable(self, base):
+        """Files of base that are exactly what this job would render, by position"""
+        if base is None or base.params["kind"] != "slides" or base.total != self.total:
+            return {}
+        return {
+            idx: base.files[idx]
+            for idx, fingerprint in enumerate(self.wanted_fingerprints())
+            if base.files[idx] and base.fingerprints[idx] == fingerprint
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "params": self.params,
+            "status": self.status,
+            "created": self.created,
+            "outline": self.outline,
+            "outline_error": self.outline_error,
+            "files": self.files,
+            "fingerprints": self.fingerprints,
+            "errors": self.errors,
+            "upgrade_errors": self.upgrade_errors,
+            "error": self.error,
+            "completed": self.completed,
+            "seconds": self.seconds,
+            "plan": self.plan,
+        }
+
+
+class JobQueue:
+    """Runs jobs on a bounded worker pool and finds them again by id, in memory or on disk"""
+
+    def __init__(self, directory=JOBS_DIR, workers=JOB_WORKERS, max_in_flight=MAX_JOBS_IN_FLIGHT,
+                 retention_seconds=RETENTION_SECONDS, gallery=None, abandon_seconds=ABANDON_SECONDS, is_alive=None):
+        self.directory = directory
+        # Where finished jobs are recorded; None keeps no history
+        self.gallery = gallery
+        self.max_in_flight = max_in_flight
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="banana-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.abandon_seconds = abandon_seconds
+        # is_alive(owner) says whether the session that owns a job is still connected; None never abandons jobs
+        self.is_alive = is_alive
+        if abandon_seconds and is_alive is not None:
+            threading.Thread(target=self._cancel_abandoned, name="banana-job-reaper", daemon=True).start()
+
+    def submit(self, params, api_key, owner=None):
+        """Queue a job on the worker pool and return it
+
+        params are those of core.JOB_DEFAULTS plus use_cache, slide_workers, draft_size, outline,
+        base_job, renderer and deadline. owner is the session following the job; the job is
+        cancelled once that session has been gone for abandon_seconds.
+        """
+        params = {
+            **JOB_DEFAULTS, "use_cache": True, "slide_workers": 4, "draft_size": None, "outline": None, "base_job": None,
+            "renderer": "image", "deadline": None,
+            **params
+        }
+        with self._lock:
+            if self._in_flight() >= self.max_in_flight:
+                self._counts["rejected"] += 1
+                raise JobQueueFull(f"{self.max_in_flight} jobs are already running; please try again in a moment")
+            job = Job(uuid.uuid4().hex[:16], params)
+            job.owner = owner
+            job.directory = os.path.join(self.directory, job.id)
+            self._jobs[job.id] = job
+            self._counts["submitted"] += 1
+        os.makedirs(job.directory, exist_ok=True)
+        self._save(job)
+        self._executor.submit(self._run, job, api_key)
+        self._prune()
+        return job
+
+    def get(self, job_id):
+        """The job with this id, or None; jobs left unfinished by an earlier process count as interrupted"""
+        if not job_id or not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        directory = os.path.join(self.directory, job_id)
+        try:
+            with open(os.path.join(directory, "job.json"), encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        state.pop("id", None)
+        job = Job(job_id, **state)
+        job.directory = directory
+        if not job.finished:
+            job.status = "interrupted"
+        return job
+
+    def cancel(self, job_id, reason="cancelled"):
+        """Stop a queued or running job; True if it was still unfinished
+
+        A queued job is dropped at once. A running one stops starting requests, stops waiting for
+        those in flight and ends as "cancelled", keeping the images it already has.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished or not job.cancel_token.cancel(reason):
+                return False
+            queued = job.status == "queued"
+            if queued:
+                job.status, job.error = "cancelled", reason
+                self._counts["cancelled"] += 1
+                self._jobs.pop(job.id, None)
+        metrics.incr("jobs_cancelled")
+        if queued:
+            self._save(job)
+        return True
+
+    def claim(self, job_id, owner):
+        """Make owner the session following job_id, e.g. a refreshed page that reattached to it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.owner, job.orphaned = owner, None
+
+    def _cancel_abandoned(self):
+        """Cancel unfinished jobs whose session has been gone for abandon_seconds, e.g. after the tab was closed
+
+        Only the owning session matters, not whether its page is polling: jobs switched away from in
+        the sidebar, or left running while the user browses the history page, keep rendering.
+        """
+        while True:
+            time.sleep(max(1.0, self.abandon_seconds / 4))
+            now = time.monotonic()
+            with self._lock:
+                owned = [job for job in self._jobs.values() if not job.finished and job.owner is not None]
+            for job in owned:
+                if self.is_alive(job.owner):
+                    job.orphaned = None
+                elif job.orphaned is None:
+                    # Give a refreshed or reconnecting browser time to reattach
+                    job.orphaned = now
+                elif now - job.orphaned >= self.abandon_seconds:
+                    self.cancel(job.id, "abandoned: its browser session was closed")
+
+    def _in_flight(self):
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _save(self, job):
+        path = os.path.join(job.directory, "job.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _run(self, job, api_key):
+        """Render job on a worker thread; a job that ends done is also recorded in the gallery
+
+        Cancellation (see cancel) ends the job as "cancelled". Under a deadline, the job keeps
+        how long it took from submission and whether the deadline was met.
+        """
+        started = time.monotonic()
+        with self._lock:
+            if job.status == "cancelled":
+                # Cancelled while queued
+                return
+            job.status = "running"
+        self._save(job)
+        try:
+            with metrics.timer(f"job_{job.params['kind']}"):
+                self._render(job, api_key)
+            job.status = "done"
+        except Cancelled as e:
+            job.status, job.error = "cancelled", str(e)
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+        job.seconds = round(time.monotonic() - started, 2)
+        if job.plan and job.status != "cancelled":
+            # The deadline runs from submission, so time spent queued counts against it
+            elapsed = time.time() - job.created
+            job.plan["seconds"] = round(elapsed, 1)
+            job.plan["deadline_met"] = job.status == "done" and elapsed <= job.params["deadline"]
+            metrics.incr("deadlines_met" if job.plan["deadline_met"] else "deadlines_missed")
+        self._save(job)
+        with self._lock:
+            self._counts[job.status if job.status in ("done", "cancelled") else "failed"] += 1
+            # Finished jobs are served from disk from now on
+            self._jobs.pop(job.id, None)
+        if job.status == "done" and self.gallery is not None:
+            self._record(job)
+
+    def _record(self, job):
+        """Add a finished job's images to the gallery; a failure here never fails the job"""
+        images = {idx: job.image(idx) for idx in range(job.total)}
+        images = {idx: image for idx, image in images.items() if image is not None}
+        if not images:
+            return
+        try:
+            self.gallery.add(job.params, images, job.outline, job.id, job.created)
+        except Exception:
+            metrics.incr("gallery_errors")
+
+    def _render(self, job, api_key):
+        """Render job's images, saving its state after every change
+
+        A mind map with renderer "local" asks the text model for a concept tree, kept as the
+        outline, and draws it without the image model. A deck derived from a base_job copies
+        every slide whose fingerprint is unchanged and renders only the rest. Under a deadline,
+        planner.py picks each slide's size, the concurrency and whether drafts come first. Drafts
+        are replaced by full-size images once every first render is in.
+        """
+        params = job.params
+        cancel = job.cancel_token
+        if params["kind"] == "mindmap" and params["renderer"] == "local":
+            from mindmap_renderer import render_png
+
+            if job.outline is None:
+                job.outline = generate_mindmap_tree(
+                    params["topic"], params["complexity"], api_key, params["instructions"], cancel
+                )
+                self._save(job)
+            cancel.check()
+            # Drawing locally takes well under a second, so there is no draft to upgrade
+            mindmap = render_png(job.outline, params["theme"], params["aspect_ratio"], params["size"])
+            job.files[0] = write_image(job.directory, "mindmap", mindmap)
+            job.completed = 1
+            return
+
+        if params["kind"] == "mindmap":
+            complexity = params["complexity"]
+            if params["instructions"]:
+                complexity = f"{complexity}. Additional instructions: {params['instructions']}"
+            mindmap_args = (params["topic"], api_key, params["theme"], params["style"], complexity, params["aspect_ratio"])
+            mindmap = render_mindmap(*mindmap_args, job.render_size, params["use_cache"], cancel)
+            if mindmap is None:
+                raise RuntimeError("the model returned no image")
+            job.files[0] = write_image(job.directory, "mindmap", mindmap)
+            job.completed = 1
+            if job.render_size != params["size"]:
+                job.status = "upgrading"
+                self._save(job)
+                try:
+                    full_size = render_mindmap(*mindmap_args, params["size"], params["use_cache"], cancel)
+                    if full_size is None:
+                        raise RuntimeError("the model returned no image")
+                    draft_file, job.files[0] = job.files[0], write_image(job.directory, "mindmap_full", full_size)
+                    os.remove(os.path.join(job.directory, draft_file))
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    job.upgrade_errors[0] = str(e)
+            return
+
+        streamed = job.outline is None
+        if streamed:
+            # No outline yet: every slide renders, each dispatched as soon as its outline entry has streamed in
+            wanted = [None] * job.total
+        else:
+            # Carry over slides the base deck already has, so only edited, restyled or failed ones are rendered
+            wanted = job.wanted_fingerprints()
+            for idx, file_name in job.reusable(self.get(params["base_job"])).items():
+                try:
+                    _link_or_copy(
+                        os.path.join(self.directory, params["base_job"], file_name), os.path.join(job.directory, file_name)
+                    )
+                except OSError:
+                    continue
+                job.files[idx], job.fingerprints[idx] = file_name, wanted[idx]
+                metrics.incr("slides_reused")
+        pending = [idx for idx, file_name in enumerate(job.files) if file_name is None]
+        reused = job.total - len(pending)
+        job.completed = reused
+        if params["deadline"] and job.plan is None and pending:
+            job.plan = plan_deck(
+                pending, job.total, params["deadline"] - (time.time() - job.created), params["size"],
+                params["slide_workers"], streamed_outline=streamed, api_key=api_key
+            )
+        self._save(job)
+        if streamed:
+            first_requests = self._streamed_requests(job, api_key, wanted)
+        else:
+            all_requests = job.slide_requests()
+            first_requests = [dict(all_requests[idx], image_size=job.first_size(idx)) for idx in pending]
+
+        def on_slide_done(position, slide_image, error, completed):
+            idx = pending[position]
+            if slide_image is not None:
+                job.files[idx] = write_image(job.directory, f"slide_{idx + 1:02d}", slide_image)
+                job.fingerprints[idx] = wanted[idx] if job.first_size(idx) == params["size"] else None
+            else:
+                job.errors[idx] = str(error or "the model returned no image")
+            job.completed = reused + completed
+            self._save(job)
+
+        render_slides(first_requests, api_key, job.slide_workers, on_slide_done, cancel)
+        drafts = [idx for idx in pending if job.files[idx] and job.first_size(idx) != job.target_size(idx)]
+        if job.plan and drafts:
+            # Only upgrade the drafts that should still land before the deadline; the rest stay drafts
+            remaining = params["deadline"] - (time.time() - job.created)
+            targets = {idx: job.target_size(idx) for idx in drafts}
+            upgrades = plan_upgrades(targets, job.total, remaining, job.slide_workers, api_key)
+            job.plan["kept_drafts"] = [idx for idx in drafts if idx not in upgrades]
+            drafts = upgrades
+        if not drafts:
+            return
+
+        # Drafts are all in; now swap in full-size renders of the slides that made it
+        job.status = "upgrading"
+        self._save(job)
+        full_size_requests = job.slide_requests()
+
+        def on_upgrade_done(position, slide_image, error, completed):
+            idx = drafts[position]
+            if slide_image is not None:
+                full_size_file = write_image(job.directory, f"slide_{idx + 1:02d}_full", slide_image)
+                draft_file, job.files[idx] = job.files[idx], full_size_file
+                job.fingerprints[idx] = wanted[idx] if job.target_size(idx) == params["size"] else None
+                # Pages polling the job read files by name, so the draft only goes once the new name is saved
+                self._save(job)
+                os.remove(os.path.join(job.directory, draft_file))
+            else:
+                job.upgrade_errors[idx] = str(error or "the model returned no image")
+            self._save(job)
+
+        upgrade_requests = [dict(full_size_requests[idx], image_size=job.target_size(idx)) for idx in drafts]
+        render_slides(upgrade_requests, api_key, job.slide_workers, on_upgrade_done, cancel)
+
+    def _streamed_requests(self, job, api_key, wanted):
+        """Slide requests in order, each yielded as soon as stream_outline completes its entry
+
+        Fills in wanted fingerprints and job.outline as entries arrive. If the outline fails part
+        way, the remaining slides render from the topic alone, as they do without an outline.
+        """
+        params = job.params
+        outline = []
+        try:
+            for entry in stream_outline(params["topic"], job.total, api_key, job.cancel_token):
+                outline.append(entry)
+                job.outline = outline
+                self._save(job)
+                yield self._slide_request(job, len(outline) - 1, wanted)
+        except Cancelled:
+            # render_slides stops submitting and raises Cancelled itself
+            return
+        except Exception as e:
+            job.outline_error = str(e)
+            self._save(job)
+        for idx in range(len(outline), job.total):
+            yield self._slide_request(job, idx, wanted)
+
+    def _slide_request(self, job, idx, wanted):
+        slide_request = dict(job.slide_requests()[idx], image_size=job.first_size(idx))
+        wanted[idx] = slide_fingerprint(dict(slide_request, image_size=job.params["size"]))
+        return slide_request
+
+    def _prune(self):
+        """Delete finished jobs past the retention period"""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            active = set(self._jobs)
+        for job_id in os.listdir(self.directory):
+            path = os.path.join(self.directory, job_id)
+            if job_id in active or not JOB_ID_PATTERN.fullmatch(job_id):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, in_flight=self._in_flight())
+
+
+def _link_or_copy(source, destination):
+    """Hard-link a finished image into another job's directory, copying where links are unsupported"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def streamlit_session_alive(session_id):
+    """Whether the Streamlit session with this id is still connected; outside a server, sessions never count as gone"""
+    from streamlit import runtime
+
+    return not runtime.exists() or runtime.get_instance().is_active_session(session_id)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """The job queue shared by every session in this process"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(gallery=get_gallery(), is_alive=streamlit_session_alive)
+            metrics.register_collector("jobs", _queue.stats)
+        return _queue
@@ -0,0 +1,154 @@
+"""Per-stage latency and counters for the generation pipeline, exported as JSON or Prometheus text"""
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Recent samples kept per stage for percentiles; sums and counts cover the whole process lifetime
+WINDOW = 2000
+METRICS_PORT = int(os.environ["BANANA_METRICS_PORT"]) if os.environ.get("BANANA_METRICS_PORT") else None
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Metrics:
+    """Thread-safe registry of stage timings, counters and collectors of component stats"""
+
+    def __init__(self, window=WINDOW):
+        self.started = time.time()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._totals = defaultdict(lambda: [0, 0.0])  # stage -> [count, sum of seconds]
+        self._counters = defaultdict(float)
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as one observation of stage, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+            totals = self._totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def register_collector(self, name, collect):
+        """Include collect() (a flat dict of numbers) in every snapshot under name"""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def stage_summary(self, stage):
+        with self._lock:
+            samples = sorted(self._samples[stage])
+            count, total = self._totals[stage]
+        return {
+            "count": count,
+            "sum": total,
+            "p50": percentile(samples, 0.5),
+            "p95": percentile(samples, 0.95),
+            "max": samples[-1] if samples else None,
+        }
+
+    def snapshot(self):
+        with self._lock:
+            stages = list(self._totals)
+            counters = dict(self._counters)
+            collectors = dict(self._collectors)
+        collected = {}
+        for name, collect in collectors.items():
+            try:
+                collected[name] = collect()
+            except Exception:
+                # A broken collector must never take the metrics page down with it
+                continue
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "stages": {stage: self.stage_summary(stage) for stage in sorted(stages)},
+            "counters": counters,
+            "components": collected,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="banana"):
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Latency of pipeline stages",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, summary in snapshot["stages"].items():
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95")):
+                if summary[key] is not None:
+                    lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {summary[key]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value:g}")
+        for component, values in sorted(snapshot["components"].items()):
+            for name, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{component}_{name} gauge")
+                    lines.append(f"{prefix}_{component}_{name} {value:g}")
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f"{prefix}_uptime_seconds {snapshot['uptime_seconds']:.3f}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+_server = None
+_server_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") == "/metrics":
+            body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path.rstrip("/") == "/metrics.json":
+            body, content_type = metrics.to_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics (Prometheus text) and /metrics.json on port; a no-op without a port or if already running"""
+    global _server
+    if port is None:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
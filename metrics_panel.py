@@ -0,0 +1,51 @@
+"""Optional sidebar panel with this process's pipeline metrics, shared by the Streamlit apps"""
+import streamlit as st
+
+from metrics import metrics
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def render_metrics_panel():
+    """Render per-stage p50/p95 and counters in the sidebar when the user opts in"""
+    with st.sidebar:
+        if not st.toggle("📈 Show performance metrics", help="Latency per pipeline stage for this server process"):
+            return
+
+        snapshot = metrics.snapshot()
+        if snapshot["stages"]:
+            st.dataframe(
+                [
+                    {
+                        "Stage": stage,
+                        "Count": summary["count"],
+                        "p50 (ms)": _ms(summary["p50"]),
+                        "p95 (ms)": _ms(summary["p95"]),
+                    }
+                    for stage, summary in snapshot["stages"].items()
+                ],
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.caption("No requests measured yet.")
+
+        counters = snapshot["counters"]
+        if counters:
+            st.caption(" • ".join(
+                f"{name.replace('_', ' ')}: {value / 1024 / 1024:.1f} MB" if "bytes" in name
+                else f"{name.replace('_', ' ')}: {value:g}"
+                for name, value in sorted(counters.items())
+            ))
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "JSON", metrics.to_json(), file_name="metrics.json", mime="application/json", use_container_width=True
+            )
+        with col2:
+            st.download_button(
+                "Prometheus", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain", use_container_width=True
+            )
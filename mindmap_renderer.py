@@ -0,0 +1,260 @@
+"""Local mind map rendering: a radial layout of a JSON concept tree, drawn as SVG or PNG
+
+The tree comes from the text model (see core.generate_mindmap_tree) and looks like
+{"title": "...", "children": [{"title": "...", "children": [...]}, ...]}. Layout is computed for
+all nodes at once with NumPy: every node gets an angular wedge proportional to the leaves below it
+and sits on the ring for its depth, stretched to the canvas aspect ratio. Drawing needs no API
+call, so a mind map can be re-themed or re-sized instantly.
+"""
+import io
+import textwrap
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from image_store import StoredImage
+from metrics import metrics
+
+# Long edge of the canvas in pixels per image size
+CANVAS_LONG_EDGE = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+# Theme label (as offered by the mind map page) -> colors; on_fill is the text color on branch fills
+THEME_PALETTES = {
+    "Modern Purple & Blue": dict(background="#F7F7FC", ink="#2D2A4A", root="#5B4BDB", on_fill="#FFFFFF",
+                                 branches=["#6C5CE7", "#4A69BD", "#8E44AD", "#3C91E6", "#A29BFE", "#2E86DE"]),
+    "Professional Blue & Gray": dict(background="#F5F7FA", ink="#2C3E50", root="#34495E", on_fill="#FFFFFF",
+                                     branches=["#2E86C1", "#5D6D7E", "#1F618D", "#85929E", "#2874A6", "#566573"]),
+    "Vibrant Rainbow": dict(background="#FFFFFF", ink="#222222", root="#222222", on_fill="#FFFFFF",
+                            branches=["#E74C3C", "#F39C12", "#27AE60", "#3498DB", "#9B59B6", "#E84393"]),
+    "Nature Green & Earth Tones": dict(background="#F6F3EA", ink="#3E3A2E", root="#5D4037", on_fill="#FFFFFF",
+                                       branches=["#558B2F", "#8D6E63", "#7CB342", "#A1887F", "#33691E", "#B08D3C"]),
+    "Warm Sunset (Orange & Pink)": dict(background="#FFF6F0", ink="#4A2C2A", root="#D35400", on_fill="#FFFFFF",
+                                        branches=["#E67E22", "#E84393", "#FF7675", "#F39C12", "#FD79A8", "#C0392B"]),
+    "Minimal Black & White": dict(background="#FFFFFF", ink="#111111", root="#111111", on_fill="#FFFFFF",
+                                  branches=["#111111", "#444444", "#666666", "#222222", "#555555", "#333333"]),
+    "Ocean Blues": dict(background="#F0F8FF", ink="#0B3C5D", root="#0B3C5D", on_fill="#FFFFFF",
+                        branches=["#1B6CA8", "#0097B2", "#0F4C75", "#3282B8", "#16A085", "#2E86C1"]),
+    "Forest Greens": dict(background="#F1F8F2", ink="#1E3D2F", root="#1E5631", on_fill="#FFFFFF",
+                          branches=["#2D6A4F", "#40916C", "#52B788", "#1B4332", "#588157", "#386641"]),
+    "Pastel Dream": dict(background="#FFFBFE", ink="#4A4453", root="#B39DDB", on_fill="#4A4453",
+                         branches=["#F8BBD0", "#B3E5FC", "#C8E6C9", "#FFE0B2", "#D1C4E9", "#FFF59D"]),
+    "Dark Mode (Dark Background)": dict(background="#1E1E2E", ink="#E0E0F0", root="#BB86FC", on_fill="#1E1E2E",
+                                        branches=["#BB86FC", "#03DAC6", "#CF6679", "#FFB74D", "#64B5F6", "#81C784"]),
+}
+DEFAULT_THEME = "Modern Purple & Blue"
+
+# Per depth (root, branch, deeper): font size as a fraction of canvas height, and characters per line
+FONT_SCALE = (0.042, 0.026, 0.019)
+WRAP_WIDTH = (18, 16, 20)
+CURVE_SAMPLES = 24
+# Outermost ring as a fraction of canvas width and height
+RING_EXTENT = (0.40, 0.38)
+
+
+def canvas_size(aspect_ratio="16:9", image_size="2K"):
+    """Pixel (width, height) of a canvas with the given aspect ratio and image size"""
+    long_edge = CANVAS_LONG_EDGE.get(image_size, CANVAS_LONG_EDGE["2K"])
+    ratio_w, ratio_h = (int(part) for part in aspect_ratio.split(":"))
+    if ratio_w >= ratio_h:
+        return long_edge, round(long_edge * ratio_h / ratio_w)
+    return round(long_edge * ratio_w / ratio_h), long_edge
+
+
+def flatten_tree(tree):
+    """Nodes in breadth-first order: (titles, parent index per node with -1 for the root, depths)"""
+    titles, parents, depths = [], [], []
+    queue = [(tree, -1, 0)]
+    for node, parent, depth in queue:
+        idx = len(titles)
+        titles.append(node["title"])
+        parents.append(parent)
+        depths.append(depth)
+        queue.extend((child, idx, depth + 1) for child in node.get("children", []))
+    return titles, np.array(parents), np.array(depths)
+
+
+def radial_layout(parents, depths, width, height):
+    """Node centres (n, 2) and angles (n,) for a breadth-first tree, computed level by level
+
+    Each node gets an angular wedge of its parent's wedge proportional to its leaf count; siblings
+    are contiguous in breadth-first order, so one cumulative sum per level places a whole ring.
+    """
+    count = len(parents)
+    max_depth = int(depths.max()) if count else 0
+
+    # Leaves below each node, accumulated bottom-up one level at a time
+    is_leaf = np.ones(count, dtype=bool)
+    is_leaf[parents[parents >= 0]] = False
+    leaves = is_leaf.astype(float)
+    for depth in range(max_depth, 0, -1):
+        level = np.flatnonzero(depths == depth)
+        np.add.at(leaves, parents[level], leaves[level])
+
+    start = np.zeros(count)
+    span = np.zeros(count)
+    span[0] = 2 * np.pi
+    for depth in range(1, max_depth + 1):
+        level = np.flatnonzero(depths == depth)
+        level_parents = parents[level]
+        # Leaves of earlier siblings: running total within the level minus the total before this parent's first child
+        before = np.cumsum(leaves[level]) - leaves[level]
+        first_sibling = np.searchsorted(level_parents, level_parents)
+        before -= before[first_sibling]
+        fraction = span[level_parents] / leaves[level_parents]
+        start[level] = start[level_parents] + before * fraction
+        span[level] = leaves[level] * fraction
+
+    # Start at twelve o'clock; crowded rings alternate between two radii so neighbouring labels do not collide
+    angles = start + span / 2 - np.pi / 2
+    radii = depths / max(max_depth, 1) * (1 - 0.08)
+    crowded = np.bincount(depths)[depths] > 8
+    radii += (np.arange(count) % 2) * 0.08 * (crowded & (depths >= 1))
+    centre = np.array([width / 2, height / 2])
+    extent = np.array(RING_EXTENT) * (width, height)
+    positions = centre + radii[:, None] * extent * np.column_stack([np.cos(angles), np.sin(angles)])
+    return positions, angles
+
+
+def edge_curves(parents, positions, angles, width, height):
+    """Quadratic curves from each parent to each child, sampled as (edges, CURVE_SAMPLES, 2) points
+
+    The control point sits at the child's angle on the parent's ring, so edges bend outward from
+    the centre like branches.
+    """
+    children = np.flatnonzero(parents >= 0)
+    start = positions[parents[children]]
+    end = positions[children]
+    centre = np.array([width / 2, height / 2])
+    extent = np.array(RING_EXTENT) * (width, height)
+    parent_reach = np.linalg.norm((start - centre) / extent, axis=1)
+    direction = np.column_stack([np.cos(angles[children]), np.sin(angles[children])])
+    control = centre + parent_reach[:, None] * extent * direction
+    t = np.linspace(0, 1, CURVE_SAMPLES)[None, :, None]
+    curves = (1 - t) ** 2 * start[:, None] + 2 * (1 - t) * t * control[:, None] + t ** 2 * end[:, None]
+    return children, curves
+
+
+def _branch_of(parents, depths):
+    """Index of the depth-1 ancestor of every node (-1 for the root)"""
+    branch = np.where(depths == 1, np.arange(len(parents)), -1)
+    for depth in range(2, int(depths.max(initial=0)) + 1):
+        level = np.flatnonzero(depths == depth)
+        branch[level] = branch[parents[level]]
+    return branch
+
+
+def _scene(tree, theme, aspect_ratio, image_size):
+    """Everything both renderers draw: canvas, palette, node labels and styles, and edge polylines"""
+    width, height = canvas_size(aspect_ratio, image_size)
+    palette = THEME_PALETTES.get(theme, THEME_PALETTES[DEFAULT_THEME])
+    titles, parents, depths = flatten_tree(tree)
+    with metrics.timer("mindmap_layout"):
+        positions, angles = radial_layout(parents, depths, width, height)
+        children, curves = edge_curves(parents, positions, angles, width, height)
+    branch = _branch_of(parents, depths)
+    branch_order = {idx: order for order, idx in enumerate(np.flatnonzero(depths == 1))}
+
+    def color(idx):
+        if branch[idx] < 0:
+            return palette["root"]
+        branches = palette["branches"]
+        return branches[branch_order[branch[idx]] % len(branches)]
+
+    nodes = []
+    for idx, title in enumerate(titles):
+        level = min(int(depths[idx]), 2)
+        nodes.append(dict(
+            lines=textwrap.wrap(title, WRAP_WIDTH[level]) or [""],
+            x=float(positions[idx, 0]),
+            y=float(positions[idx, 1]),
+            level=level,
+            font_size=max(10, round(height * FONT_SCALE[level])),
+            color=color(idx),
+        ))
+    edges = [
+        dict(
+            points=curves[position], color=color(child),
+            width=max(2, round(height * (0.006 if depths[child] == 1 else 0.003)))
+        )
+        for position, child in enumerate(children)
+    ]
+    return width, height, palette, nodes, edges
+
+
+def _box(node, text_width):
+    """Padded label box (left, top, right, bottom) around a node's text"""
+    font_size = node["font_size"]
+    half_w = text_width / 2 + font_size * 0.7
+    half_h = len(node["lines"]) * font_size * 0.62 + font_size * 0.45
+    return node["x"] - half_w, node["y"] - half_h, node["x"] + half_w, node["y"] + half_h
+
+
+def render_svg(tree, theme=DEFAULT_THEME, aspect_ratio="16:9", image_size="2K"):
+    """The mind map as an SVG document (text stays selectable and editable)"""
+    width, height, palette, nodes, edges = _scene(tree, theme, aspect_ratio, image_size)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" '
+        f'font-family="Helvetica, Arial, sans-serif">',
+        f'<rect width="100%" height="100%" fill="{palette["background"]}"/>',
+    ]
+    for edge in edges:
+        points = " ".join(f"{x:.1f},{y:.1f}" for x, y in edge["points"])
+        parts.append(
+            f'<polyline points="{points}" fill="none" stroke="{edge["color"]}" '
+            f'stroke-width="{edge["width"]}" stroke-linecap="round"/>'
+        )
+    for node in nodes:
+        font_size = node["font_size"]
+        # SVG has no text metrics; average glyph width is about 0.55 em
+        left, top, right, bottom = _box(node, max(len(line) for line in node["lines"]) * font_size * 0.55)
+        filled = node["level"] < 2
+        parts.append(
+            f'<rect x="{left:.1f}" y="{top:.1f}" width="{right - left:.1f}" height="{bottom - top:.1f}" '
+            f'rx="{font_size * 0.6:.1f}" fill="{node["color"] if filled else palette["background"]}" '
+            f'stroke="{node["color"]}" stroke-width="{max(2, font_size // 10)}"/>'
+        )
+        first_line = node["y"] - (len(node["lines"]) - 1) * font_size * 0.6
+        spans = "".join(
+            f'<tspan x="{node["x"]:.1f}" y="{first_line + number * font_size * 1.2:.1f}">{escape(line)}</tspan>'
+            for number, line in enumerate(node["lines"])
+        )
+        parts.append(
+            f'<text text-anchor="middle" dominant-baseline="central" font-size="{font_size}" '
+            f'font-weight="{"bold" if node["level"] < 2 else "normal"}" '
+            f'fill="{palette["on_fill"] if filled else palette["ink"]}">{spans}</text>'
+        )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def render_png(tree, theme=DEFAULT_THEME, aspect_ratio="16:9", image_size="2K"):
+    """The mind map as a PNG StoredImage"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    width, height, palette, nodes, edges = _scene(tree, theme, aspect_ratio, image_size)
+    with metrics.timer("mindmap_draw"):
+        img = Image.new("RGB", (width, height), palette["background"])
+        draw = ImageDraw.Draw(img)
+        for edge in edges:
+            points = [tuple(point) for point in edge["points"].tolist()]
+            draw.line(points, fill=edge["color"], width=edge["width"], joint="curve")
+        fonts = {}
+        for node in nodes:
+            font_size = node["font_size"]
+            if font_size not in fonts:
+                fonts[font_size] = ImageFont.load_default(size=font_size)
+            text = "\n".join(node["lines"])
+            text_left, _, text_right, _ = draw.multiline_textbbox((0, 0), text, font=fonts[font_size], align="center")
+            box = _box(node, text_right - text_left)
+            filled = node["level"] < 2
+            draw.rounded_rectangle(
+                box, radius=font_size * 0.6, fill=node["color"] if filled else palette["background"],
+                outline=node["color"], width=max(2, font_size // 10)
+            )
+            draw.multiline_text(
+                (node["x"], node["y"]), text, font=fonts[font_size], anchor="mm", align="center",
+                fill=palette["on_fill"] if filled else palette["ink"], spacing=font_size * 0.2
+            )
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG", compress_level=3)
+    return StoredImage(buffer.getvalue(), "image/png")
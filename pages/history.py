@@ -0,0 +1,161 @@
+import time
+from functools import partial
+import streamlit as st
+from export import EXPORT_FORMATS, export_deck
+from gallery import PAGE_SIZE, get_gallery
+from metrics_panel import render_metrics_panel
+
+# Setup Streamlit page
+st.set_page_config(
+    page_title="Generation History",
+    page_icon="🗂️",
+    layout="wide"
+)
+
+# Cursors of the pages visited so far, so Newer can step back without re-reading the older ones
+if 'history_cursors' not in st.session_state:
+    st.session_state.history_cursors = [None]
+if 'history_entry' not in st.session_state:
+    st.session_state.history_entry = None
+
+gallery = get_gallery()
+
+def restart_paging():
+    """Go back to the newest page when the search changes"""
+    st.session_state.history_cursors = [None]
+
+def open_entry(entry_id):
+    st.session_state.history_entry = entry_id
+
+def close_entry():
+    st.session_state.history_entry = None
+
+def gallery_png(digest, mime_type):
+    """Read and encode a full-size image only when its download button is clicked"""
+    image = gallery.image(digest, mime_type)
+    return image.png_bytes() if image is not None else b""
+
+def gallery_export(images, export_format):
+    """Build the deck file only when its download button is clicked; missing slides keep their numbers"""
+    digests = {image["position"]: image["digest"] for image in images}
+    sources = [partial(gallery.image, digests[position]) if position in digests else None
+               for position in range(max(digests, default=-1) + 1)]
+    return export_deck(sources, export_format)[0]
+
+def show_entry(entry):
+    """Full view of one past result, read from the gallery without any API call"""
+    params = entry["params"]
+    file_stem = entry["topic"][:20].replace(' ', '_')
+    st.subheader(f"{'🧠' if entry['kind'] == 'mindmap' else '📊'} {entry['topic']}")
+    st.caption(f"{entry['theme']} · {entry['style']} · {entry['size']} · {entry['aspect_ratio']} · "
+               f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))}")
+
+    # Stored display-size previews: a rerun never decodes a full-size image
+    previews = [gallery.preview(image["digest"]) for image in entry["images"]]
+    if entry["kind"] == "mindmap":
+        if previews and previews[0] is not None:
+            st.image(previews[0], use_container_width=True)
+            st.download_button(
+                label="📥 Download Mind Map (PNG)",
+                data=partial(gallery_png, entry["images"][0]["digest"], entry["images"][0]["mime_type"]),
+                file_name=f"mindmap_{file_stem}.png",
+                mime="image/png"
+            )
+        if params.get("renderer") == "local" and entry["outline"]:
+            from mindmap_renderer import render_svg
+
+            st.download_button(
+                label="📐 Download Mind Map (SVG)",
+                data=partial(render_svg, entry["outline"], entry["theme"], entry["aspect_ratio"], entry["size"]),
+                file_name=f"mindmap_{file_stem}.svg",
+                mime="image/svg+xml"
+            )
+    else:
+        tabs = st.tabs([f"Slide {image['position'] + 1}" for image in entry["images"]])
+        for tab, image, preview in zip(tabs, entry["images"], previews):
+            with tab:
+                if preview is None:
+                    st.warning("This slide's image is no longer stored.")
+                    continue
+                st.image(preview, use_container_width=True)
+                st.download_button(
+                    label=f"📥 Download Slide {image['position'] + 1}",
+                    data=partial(gallery_png, image["digest"], image["mime_type"]),
+                    file_name=f"slide_{image['position'] + 1}_{file_stem}.png",
+                    mime="image/png",
+                    key=f"history_download_{image['position']}"
+                )
+        col1, col2 = st.columns(2)
+        with col1:
+            export_format = st.selectbox("Export Format:", list(EXPORT_FORMATS))
+            _, _, export_mime, export_extension = EXPORT_FORMATS[export_format]
+            st.download_button(
+                label=f"📦 Download All Slides ({export_format})",
+                data=partial(gallery_export, entry["images"], export_format),
+                file_name=f"presentation_{file_stem}.{export_extension}",
+                mime=export_mime,
+                use_container_width=True
+            )
+        if entry["outline"]:
+            with col2, st.expander("📋 View Content Outline"):
+                for slide_num, slide_outline in enumerate(entry["outline"], start=1):
+                    st.markdown(f"**Slide {slide_num}: {slide_outline.get('title', '')}**")
+    st.button("⬅️ Back to History", on_click=close_entry)
+
+st.title("🗂️ Generation History")
+st.markdown("Every finished mind map and deck is kept here; opening one again costs no API call")
+
+if st.session_state.history_entry is not None:
+    entry = gallery.entry(st.session_state.history_entry)
+    if entry is None:
+        close_entry()
+    else:
+        show_entry(entry)
+        render_metrics_panel()
+        st.stop()
+
+col1, col2 = st.columns([3, 1])
+with col1:
+    query = st.text_input(
+        "Search:",
+        placeholder="e.g., machine learning, sunset, minimalist",
+        help="Matches words in the topic, theme and style",
+        on_change=restart_paging
+    )
+with col2:
+    kind_label = st.selectbox("Show:", ["Everything", "Mind maps", "Decks"], on_change=restart_paging)
+kind = {"Everything": None, "Mind maps": "mindmap", "Decks": "slides"}[kind_label]
+
+cursors = st.session_state.history_cursors
+entries, next_cursor = gallery.page(query, kind, cursors[-1])
+
+if not entries:
+    st.info("No results match your search." if query else "Nothing here yet. Finished mind maps and decks show up here.")
+else:
+    columns = st.columns(4)
+    for number, entry in enumerate(entries):
+        with columns[number % 4]:
+            thumbnail = gallery.thumbnail(entry["cover"]) if entry["cover"] else None
+            if thumbnail:
+                st.image(thumbnail, use_container_width=True)
+            label = "Mind map" if entry["kind"] == "mindmap" else f"{entry['image_count']} slides"
+            st.caption(f"**{entry['topic'][:60]}**  \n{label} · {entry['theme']} · "
+                       f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))}")
+            st.button(
+                "Open", key=f"open_{entry['id']}", on_click=open_entry, args=(entry["id"],), use_container_width=True
+            )
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Newer", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)} · {PAGE_SIZE} per page · {gallery.count()} entries in total")
+    with col3:
+        if st.button("Older ➡️", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
+            st.rerun()
+
+# Sidebar metrics are rendered last so they include this run's requests
+render_metrics_panel()
@@ -0,0 +1,168 @@
+"""Deadline-aware deck planning: per-slide resolution, concurrency and draft fallback for a time budget
+
+Given a budget in seconds, plan_deck picks the best deck it expects to finish in time. Latency
+per image size comes from the image_api_<size> history in metrics, falling back to defaults
+until enough requests have been seen. All slides start at the requested size; while the
+simulated deck misses the budget, content slides are stepped down a size first, then the
+conclusion, then the title slide. The smallest concurrency that still fits is used, so a deck
+does not take more of the shared per-key quota than it needs.
+
+Plans are first fitted to p95 latency. If only a plan on median latency fits, the deck renders
+fast drafts first, and plan_upgrades decides, with the time actually left, which drafts can
+still be replaced in time; the rest keep their draft.
+"""
+import heapq
+
+from metrics import metrics
+from scheduler import get_scheduler
+
+# Image sizes from best to fastest
+SIZE_LADDER = ("4K", "2K", "1K")
+# Seconds per image (median, p95) until metrics has MIN_SAMPLES requests of that size
+DEFAULT_LATENCY = {"4K": (35.0, 60.0), "2K": (20.0, 35.0), "1K": (12.0, 20.0)}
+# Seconds until the first outline entry arrives, and until the whole outline has, when there is no history
+DEFAULT_OUTLINE = {"first": (3.0, 6.0), "total": (8.0, 15.0)}
+MIN_SAMPLES = 3
+
+
+def _observed(stage, default, use_p95):
+    summary = metrics.stage_summary(stage)
+    if summary["count"] < MIN_SAMPLES:
+        return default[1] if use_p95 else default[0]
+    return summary["p95"] if use_p95 else summary["p50"]
+
+
+def image_seconds(image_size, use_p95=False):
+    """Expected (median, or p95) seconds for one image of image_size"""
+    return _observed(f"image_api_{image_size}", DEFAULT_LATENCY.get(image_size, DEFAULT_LATENCY["4K"]), use_p95)
+
+
+def outline_arrivals(count, use_p95=False):
+    """Seconds after the start at which each of count streamed outline entries is expected to be complete"""
+    first = _observed("outline_first_slide", DEFAULT_OUTLINE["first"], use_p95)
+    total = max(first, _observed("outline_api", DEFAULT_OUTLINE["total"], use_p95))
+    return [first + (total - first) * idx / max(count - 1, 1) for idx in range(count)]
+
+
+def simulate(durations, arrivals, concurrency, tokens=None, rate=None):
+    """Seconds until the last of these requests finishes
+
+    Requests start in order, each on the first free worker once it has arrived and the token
+    bucket allows it: tokens are available at the start (a full burst by default), and more
+    arrive at the scheduler's rate.
+    """
+    scheduler = get_scheduler()
+    rate = scheduler.rate if rate is None else rate
+    tokens = scheduler.burst if tokens is None else tokens
+    workers = [0.0] * max(1, concurrency)
+    finish = 0.0
+    for number, (duration, arrival) in enumerate(zip(durations, arrivals)):
+        token = max(0.0, (number + 1 - tokens) / rate) if rate > 0 else 0.0
+        start = max(heapq.heappop(workers), arrival, token)
+        heapq.heappush(workers, start + duration)
+        finish = max(finish, start + duration)
+    return finish
+
+
+def downgrade_order(positions, total_slides):
+    """Slide positions in the order they give up resolution
+
+    Content slides go last to first, then the conclusion, then the title.
+    """
+    title, conclusion = 0, total_slides - 1
+    content = sorted((idx for idx in positions if idx not in (title, conclusion)), reverse=True)
+    ends = [conclusion, title] if conclusion != title else [title]
+    return content + [idx for idx in ends if idx in positions]
+
+
+def plan_deck(positions, total_slides, budget_seconds, max_size, max_concurrency, streamed_outline=True, api_key=None):
+    """Plan the slides at positions (of a total_slides deck) to finish within budget_seconds
+
+    Returns a dict kept with the job: sizes (position -> size), concurrency, draft_size (None when
+    no draft pass is needed), draft_seconds (until every draft is in, or None), estimated_seconds
+    (until every slide is at its planned size, drafts included; median latencies), budget_seconds
+    and feasible.
+    With streamed_outline, slides become ready as the outline streams in rather than at once.
+    With api_key, the key's token bucket is taken as it is now rather than full.
+    """
+    positions = list(positions)
+    tokens = get_scheduler().available(api_key) if api_key else None
+    if tokens is not None and streamed_outline:
+        # The outline request takes a token first
+        tokens -= 1
+    ladder = SIZE_LADDER[SIZE_LADDER.index(max_size):] if max_size in SIZE_LADDER else SIZE_LADDER
+    max_concurrency = max(1, min(max_concurrency, len(positions) or 1))
+    order = downgrade_order(positions, total_slides)
+
+    def fit(use_p95):
+        """Best sizes and smallest concurrency that fit the budget, stepping sizes down one rung at a time"""
+        arrivals = outline_arrivals(len(positions), use_p95) if streamed_outline else [0.0] * len(positions)
+        sizes = {idx: ladder[0] for idx in positions}
+        # Every slide in downgrade order steps down before any steps down twice
+        steps = [idx for _ in ladder[1:] for idx in order]
+        for downgrades in range(len(steps) + 1):
+            if downgrades:
+                idx = steps[downgrades - 1]
+                sizes[idx] = ladder[ladder.index(sizes[idx]) + 1]
+            durations = [image_seconds(sizes[idx], use_p95) for idx in positions]
+            for concurrency in range(1, max_concurrency + 1):
+                if simulate(durations, arrivals, concurrency, tokens) <= budget_seconds:
+                    return sizes, concurrency, downgrades
+        return sizes, None, len(steps)
+
+    # A plan that fits even on p95 latency needs no safety net
+    sizes, concurrency, downgrades = fit(use_p95=True)
+    draft_size = None
+    if concurrency is None:
+        # Fits only on median latency: render drafts first so a slow run still ends with a whole deck,
+        # then upgrade whatever plan_upgrades finds time for
+        sizes, concurrency, downgrades = fit(use_p95=False)
+        if concurrency is not None and any(size != ladder[-1] for size in sizes.values()):
+            draft_size = ladder[-1]
+            concurrency = max_concurrency
+    metrics.incr("planner_downgrades", downgrades)
+
+    feasible = concurrency is not None
+    concurrency = concurrency or max_concurrency
+    arrivals = outline_arrivals(len(positions)) if streamed_outline else [0.0] * len(positions)
+    draft_seconds = None
+    if draft_size is None:
+        estimated = simulate([image_seconds(sizes[idx]) for idx in positions], arrivals, concurrency, tokens)
+    else:
+        draft_seconds, estimated = estimate_with_drafts(sizes, positions, draft_size, arrivals, concurrency, tokens)
+    return {
+        "sizes": {str(idx): size for idx, size in sizes.items()},
+        "concurrency": concurrency,
+        "draft_size": draft_size,
+        "draft_seconds": None if draft_seconds is None else round(draft_seconds, 1),
+        "estimated_seconds": round(estimated, 1),
+        "budget_seconds": budget_seconds,
+        "feasible": feasible,
+    }
+
+
+def estimate_with_drafts(sizes, positions, draft_size, arrivals, concurrency, tokens=None):
+    """Median seconds until every slide has its draft, and until those planned above draft_size are also upgraded"""
+    scheduler = get_scheduler()
+    tokens = scheduler.burst if tokens is None else tokens
+    drafts = simulate([image_seconds(draft_size)] * len(positions), arrivals, concurrency, tokens)
+    # The draft pass spends a token per slide; the bucket refills meanwhile
+    tokens = min(scheduler.burst, tokens - len(positions) + drafts * scheduler.rate)
+    upgrades = [image_seconds(sizes[idx]) for idx in positions if sizes[idx] != draft_size]
+    return drafts, drafts + simulate(upgrades, [0.0] * len(upgrades), concurrency, tokens)
+
+
+def plan_upgrades(targets, total_slides, remaining_seconds, concurrency, api_key=None):
+    """Positions (of targets: position -> size) whose full-size render should land within remaining_seconds at p95
+
+    Slides are considered title first, then the conclusion, then content slides in order; the
+    rest keep their draft.
+    """
+    tokens = get_scheduler().available(api_key) if api_key else None
+    chosen = []
+    for idx in reversed(downgrade_order(list(targets), total_slides)):
+        trial = chosen + [idx]
+        durations = [image_seconds(targets[position], use_p95=True) for position in trial]
+        if simulate(durations, [0.0] * len(trial), concurrency, tokens) <= remaining_seconds:
+            chosen = trial
+    return sorted(chosen)
@@ -0,0 +1,285 @@
+"""Process-wide scheduler for Gemini API calls: per-key rate limiting, retries with backoff, hedging and cancellation"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cancellation import Cancelled
+
+REQUESTS_PER_MINUTE = float(os.environ.get("BANANA_REQUESTS_PER_MINUTE", "60"))
+BURST = int(os.environ.get("BANANA_BURST", "10"))
+MAX_RETRIES = int(os.environ.get("BANANA_MAX_RETRIES", "4"))
+# Seconds to wait before firing a duplicate of a slow request; unset disables hedging
+HEDGE_AFTER = float(os.environ["BANANA_HEDGE_AFTER"]) if os.environ.get("BANANA_HEDGE_AFTER") else None
+# Duplicates in flight at once; a slow request gets no hedge while they are all busy
+HEDGE_WORKERS = int(os.environ.get("BANANA_HEDGE_WORKERS", "16"))
+# Threads for cancellable calls and first attempts of hedged ones; an abandoned call holds one until its response arrives
+CALL_WORKERS = int(os.environ.get("BANANA_CALL_WORKERS", "64"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """Rate limits, server errors and dropped connections are worth another attempt"""
+    if getattr(error, "code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+def retry_after(error):
+    """Server-suggested delay in seconds, if the error carries a Retry-After header"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self):
+        """Tokens that could be taken right now (fractional while refilling)"""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self):
+        """Take a token if one is available right now"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, cancel=None):
+        """Block until a token is available, then take it; raises Cancelled if cancel is cancelled meanwhile"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            if cancel is None:
+                time.sleep(wait_time)
+            elif cancel.wait(wait_time):
+                raise Cancelled(cancel.reason)
+
+
+class RequestScheduler:
+    """Runs API calls under a per-key token bucket, retrying retryable errors and hedging slow calls"""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, burst=BURST, max_retries=MAX_RETRIES,
+                 base_delay=1.0, max_delay=30.0, hedge_after=HEDGE_AFTER, hedge_workers=HEDGE_WORKERS,
+                 call_workers=CALL_WORKERS):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        # dropped: cancelled before reaching the API (queued, waiting for quota or backing off);
+        # abandoned: requests already sent whose responses nobody was waiting for any more
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "dropped": 0, "abandoned": 0}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        # Only duplicates run here, so hedging never limits how many first attempts are in flight
+        self.hedge_workers = hedge_workers
+        self._hedges_running = 0
+        self._hedge_executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="hedge")
+        # Cancellable and hedged calls run here so their caller can stop waiting;
+        # abandoned ones hold a thread until they return, so both are metered in gauges()
+        self.call_workers = call_workers
+        self._calls_running = 0
+        self._abandoned = set()
+        self._call_executor = ThreadPoolExecutor(max_workers=call_workers, thread_name_prefix="api-call")
+
+    def _bucket(self, api_key):
+        with self._lock:
+            if api_key not in self._buckets:
+                self._buckets[api_key] = TokenBucket(self.rate, self.burst)
+            return self._buckets[api_key]
+
+    def available(self, api_key):
+        """Requests api_key could start right now without waiting for its token bucket"""
+        return self._bucket(api_key).available()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def gauges(self):
+        """Call pool occupancy; calls_queued above 0 means new calls are waiting behind running or abandoned ones"""
+        with self._lock:
+            return {
+                "call_workers": self.call_workers,
+                "calls_running": self._calls_running,
+                "calls_queued": max(0, self._calls_running - self.call_workers),
+                "abandoned_running": len(self._abandoned),
+            }
+
+    def backoff(self, attempt, error):
+        """Full-jitter exponential backoff, deferring to Retry-After when the server sends one"""
+        suggested = retry_after(error)
+        if suggested is not None:
+            return min(self.max_delay, suggested)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, api_key, fn, hedge=False, cancel=None):
+        """Run fn() for api_key, returning its result or raising its last error
+
+        With a cancel token, the call raises Cancelled as soon as the token is cancelled: before
+        an attempt, while waiting for quota or backing off, or while fn() is in flight, in which
+        case its response is discarded when it arrives.
+        """
+        bucket = self._bucket(api_key)
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            try:
+                if cancel is not None:
+                    cancel.check()
+                bucket.acquire(cancel)
+            except Cancelled:
+                self._count("dropped")
+                raise
+            try:
+                if hedge and self.hedge_after is not None:
+                    return self._call_hedged(bucket, fn, cancel)
+                if cancel is not None:
+                    return self._call_cancellable(fn, cancel)
+                return fn()
+            except Cancelled:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                delay = self.backoff(attempt, e)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    self._count("dropped")
+                    raise Cancelled(cancel.reason)
+
+    def _wait(self, futures, timeout=None, cancel=None):
+        """wait(futures, FIRST_COMPLETED) that also wakes up on cancellation, abandoning the futures still running"""
+        if cancel is None:
+            return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        woken = threading.Event()
+        for future in futures:
+            future.add_done_callback(lambda _: woken.set())
+        unregister = cancel.on_cancel(woken.set)
+        try:
+            woken.wait(timeout)
+        finally:
+            unregister()
+        done = {future for future in futures if future.done()}
+        pending = set(futures) - done
+        if cancel.cancelled and not done:
+            # Calls still queued for a thread never start; the ones already sent hold theirs until they return
+            started = [future for future in pending if not future.cancel()]
+            self._count("dropped", len(pending) - len(started))
+            self._count("abandoned", len(started))
+            with self._lock:
+                self._abandoned.update(started)
+            for future in started:
+                future.add_done_callback(self._forget_abandoned)
+            raise Cancelled(cancel.reason)
+        return done, pending
+
+    def _forget_abandoned(self, future):
+        with self._lock:
+            self._abandoned.discard(future)
+
+    def _submit_call(self, fn):
+        """Run fn() on the call pool, counting it until it returns"""
+        with self._lock:
+            self._calls_running += 1
+        future = self._call_executor.submit(fn)
+        future.add_done_callback(self._call_finished)
+        return future
+
+    def _call_finished(self, _future):
+        with self._lock:
+            self._calls_running -= 1
+
+    def _call_cancellable(self, fn, cancel):
+        """Run fn() off the calling thread so a cancellation does not have to wait for its response"""
+        future = self._submit_call(fn)
+        self._wait([future], cancel=cancel)
+        return future.result()
+
+    def _reserve_hedge(self):
+        """Take a free hedge worker, so a duplicate never queues behind the requests it should race"""
+        with self._lock:
+            if self._hedges_running >= self.hedge_workers:
+                return False
+            self._hedges_running += 1
+            return True
+
+    def _release_hedge(self, _future=None):
+        with self._lock:
+            self._hedges_running -= 1
+
+    def _call_hedged(self, bucket, fn, cancel=None):
+        """Start fn(); if it is still running after hedge_after seconds, race a duplicate against it"""
+        primary = self._submit_call(fn)
+        done, _ = self._wait([primary], self.hedge_after, cancel)
+        if done or not self._reserve_hedge():
+            self._wait([primary], cancel=cancel)
+            return primary.result()
+        # Hedges never wait for quota: a throttled duplicate would only add load
+        if not bucket.try_acquire():
+            self._release_hedge()
+            self._wait([primary], cancel=cancel)
+            return primary.result()
+
+        self._count("hedges")
+        hedged = self._hedge_executor.submit(fn)
+        hedged.add_done_callback(self._release_hedge)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = self._wait(pending, cancel=cancel)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The scheduler shared by every session in this process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
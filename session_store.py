@@ -0,0 +1,262 @@
+"""Disk-spilled storage for per-session images and exports, with memory and disk quotas
+
+Streamlit sessions keep only ImageHandle objects in session_state. The bytes live in files under
+the spool directory next to their display previews, and a small LRU hot set keeps recently used
+images in RAM, together with their memoized previews. Quotas:
+
+    BANANA_SESSION_DIR            spool directory (default: a temp dir per process)
+    BANANA_SESSION_HOT_MB         RAM for the hot set across all sessions (default 256)
+    BANANA_SESSION_QUOTA_MB       bytes one session may keep on disk (default 512)
+    BANANA_SESSION_GLOBAL_MB      bytes all sessions may keep on disk (default 8192)
+    BANANA_SESSION_IDLE_SECONDS   sessions untouched this long are dropped (default 3600)
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from image_store import StoredImage
+from metrics import metrics
+
+MB = 1024 * 1024
+HOT_BYTES = int(os.environ.get("BANANA_SESSION_HOT_MB", "256")) * MB
+SESSION_QUOTA = int(os.environ.get("BANANA_SESSION_QUOTA_MB", "512")) * MB
+GLOBAL_QUOTA = int(os.environ.get("BANANA_SESSION_GLOBAL_MB", "8192")) * MB
+IDLE_SECONDS = float(os.environ.get("BANANA_SESSION_IDLE_SECONDS", "3600"))
+
+
+class ImageHandle:
+    """What session_state holds instead of image bytes"""
+
+    __slots__ = ("id", "session_id", "mime_type", "nbytes")
+
+    def __init__(self, id, session_id, mime_type, nbytes):
+        self.id = id
+        self.session_id = session_id
+        self.mime_type = mime_type
+        self.nbytes = nbytes
+
+    def __repr__(self):
+        return f"ImageHandle({self.id}, {self.mime_type}, {self.nbytes} bytes)"
+
+
+class _Session:
+    def __init__(self):
+        self.entries = OrderedDict()  # handle id -> size, oldest first
+        self.bytes = 0
+        self.last_seen = time.monotonic()
+
+
+class SessionImageStore:
+    """Per-session byte store that spills to disk and keeps a bounded hot set in memory"""
+
+    def __init__(self, directory=None, hot_bytes=HOT_BYTES, session_quota=SESSION_QUOTA,
+                 global_quota=GLOBAL_QUOTA, idle_seconds=IDLE_SECONDS):
+        self.directory = directory or os.environ.get("BANANA_SESSION_DIR") or tempfile.mkdtemp(prefix="banana-sessions-")
+        self.hot_bytes = hot_bytes
+        self.session_quota = session_quota
+        self.global_quota = global_quota
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._disk_bytes = 0
+        self._hot = OrderedDict()  # handle id -> (StoredImage, accounted bytes), least recent first
+        self._hot_total = 0
+        self._lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, session_id, handle_id):
+        return os.path.join(self.directory, session_id, handle_id)
+
+    def _write(self, path, data):
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def _delete(self, paths):
+        """Remove files and session directories dropped under the lock, after releasing it"""
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def touch(self, session_id):
+        """Mark a session as active and drop sessions that have been idle too long"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+            dropped = self._drop_idle()
+        self._delete(dropped)
+
+    def put(self, session_id, data, mime_type=None):
+        """Spill data and its display preview to disk for session_id and return its handle
+
+        Every image put here is shown on the page, so the preview is made now and kept: a load
+        that misses the hot set never has to decode the full-size image again.
+        """
+        stored_image = data if isinstance(data, StoredImage) else StoredImage(data, mime_type)
+        preview = stored_image.preview_bytes()
+        handle = ImageHandle(uuid.uuid4().hex, session_id, stored_image.mime_type, len(stored_image.data) + len(preview))
+
+        path = self._path(session_id, handle.id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(path + ".preview", preview)
+        self._write(path, stored_image.data)
+
+        with self._lock:
+            session = self._sessions.setdefault(session_id, _Session())
+            session.last_seen = time.monotonic()
+            session.entries[handle.id] = handle.nbytes
+            session.bytes += handle.nbytes
+            self._disk_bytes += handle.nbytes
+            self._remember(handle.id, stored_image)
+            dropped = self._enforce_quotas(session_id, keep=handle.id)
+        self._delete(dropped)
+        metrics.incr("session_spilled_bytes", handle.nbytes)
+        return handle
+
+    def load(self, handle):
+        """The StoredImage for handle, or None once it has been evicted"""
+        if handle is None:
+            return None
+        with self._lock:
+            hot = self._hot.get(handle.id)
+            if hot is not None:
+                self._hot.move_to_end(handle.id)
+                self._remember(handle.id, hot[0])
+                return hot[0]
+            session = self._sessions.get(handle.session_id)
+            if session is None or handle.id not in session.entries:
+                return None
+        path = self._path(handle.session_id, handle.id)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path + ".preview", "rb") as f:
+                preview = f.read()
+        except OSError:
+            return None
+        metrics.incr("session_disk_reads")
+        stored_image = StoredImage(data, handle.mime_type, preview)
+        with self._lock:
+            self._remember(handle.id, stored_image)
+        return stored_image
+
+    def release(self, handle):
+        """Free a handle the session no longer needs"""
+        if handle is None:
+            return
+        with self._lock:
+            dropped = self._forget(handle.session_id, handle.id)
+        self._delete(dropped)
+
+    def drop_session(self, session_id):
+        with self._lock:
+            dropped = self._drop_session(session_id)
+        self._delete(dropped)
+
+    def _drop_session(self, session_id):
+        """Forget a session; returns its directory, moved aside so a new one can start in its place"""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return []
+        for handle_id in session.entries:
+            self._forget_hot(handle_id)
+        self._disk_bytes -= session.bytes
+        directory = os.path.join(self.directory, session_id)
+        dropped = f"{directory}.dropped-{uuid.uuid4().hex}"
+        try:
+            os.rename(directory, dropped)
+        except OSError:
+            return []
+        return [dropped]
+
+    def _remember(self, handle_id, stored_image):
+        """(Re)account a StoredImage in the hot set; its footprint grows as previews are memoized"""
+        self._forget_hot(handle_id)
+        footprint = stored_image.nbytes()
+        if footprint > self.hot_bytes:
+            return
+        self._hot[handle_id] = (stored_image, footprint)
+        self._hot_total += footprint
+        while self._hot_total > self.hot_bytes:
+            _, (_, evicted_footprint) = self._hot.popitem(last=False)
+            self._hot_total -= evicted_footprint
+
+    def _forget_hot(self, handle_id):
+        hot = self._hot.pop(handle_id, None)
+        if hot is not None:
+            self._hot_total -= hot[1]
+
+    def _forget(self, session_id, handle_id):
+        """Forget one image; returns its files for _delete"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return []
+        size = session.entries.pop(handle_id, None)
+        if size is None:
+            return []
+        session.bytes -= size
+        self._disk_bytes -= size
+        self._forget_hot(handle_id)
+        path = self._path(session_id, handle_id)
+        return [path, path + ".preview"]
+
+    def _enforce_quotas(self, session_id, keep):
+        """Evict down to the quotas; returns the files and directories to _delete"""
+        dropped = []
+        session = self._sessions[session_id]
+        # Over its own quota: the session loses its oldest images first
+        for handle_id in list(session.entries):
+            if session.bytes <= self.session_quota:
+                break
+            if handle_id != keep:
+                dropped += self._forget(session_id, handle_id)
+                metrics.incr("session_quota_evictions")
+        # Over the global quota: least recently active sessions go first, the current one last
+        if self._disk_bytes > self.global_quota:
+            for other_id in sorted(self._sessions, key=lambda sid: self._sessions[sid].last_seen):
+                if self._disk_bytes <= self.global_quota:
+                    break
+                if other_id != session_id:
+                    dropped += self._drop_session(other_id)
+                    metrics.incr("session_global_evictions")
+        return dropped
+
+    def _drop_idle(self):
+        dropped = []
+        cutoff = time.monotonic() - self.idle_seconds
+        for session_id in [sid for sid, session in self._sessions.items() if session.last_seen < cutoff]:
+            dropped += self._drop_session(session_id)
+            metrics.incr("session_idle_evictions")
+        return dropped
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "disk_bytes": self._disk_bytes,
+                "hot_bytes": self._hot_total,
+                "hot_entries": len(self._hot),
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """The store shared by every session in this process"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionImageStore()
+            metrics.register_collector("session_store", _store.stats)
+        return _store
@@ -0,0 +1,66 @@
+"""Single-flight coalescing: concurrent calls with the same key share one execution"""
+import threading
+
+# How often a waiting caller with a cancel token checks it
+CANCEL_POLL_SECONDS = 0.1
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs fn() once per key at a time; callers arriving while it runs wait for and share its result"""
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, cancel=None):
+        """fn(), or the outcome of the call already running for key
+
+        A cancel token lets a waiting caller give up early.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if cancel is None:
+                call.done.wait()
+            else:
+                # Only this caller gives up; the leader carries on for everyone else waiting
+                while not call.done.wait(CANCEL_POLL_SECONDS):
+                    cancel.check()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Later callers start a new flight; the ones already waiting get this outcome
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": len(self._calls)}
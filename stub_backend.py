@@ -0,0 +1,170 @@
+"""Local stand-in for the parts of genai.Client these apps use, for benchmarks and load tests
+
+Set BANANA_STUB_BACKEND=1 to make core.get_client_manager() hand out StubClient instances instead of
+real clients; no API key or network access is needed. Text requests get a JSON slide outline or,
+for the mind map tree prompt, a JSON concept tree; streamed text arrives in STREAM_CHUNKS pieces. Behaviour is tuned with:
+
+    BANANA_STUB_LATENCY_1K / _2K / _4K     seconds per image request (default 1.0 / 2.0 / 4.0)
+    BANANA_STUB_LATENCY_TEXT               seconds per text request (default 0.5)
+    BANANA_STUB_JITTER                     +/- fraction applied to every latency (default 0.2)
+    BANANA_STUB_ERROR_RATE                 probability a request fails with a retryable 503 (default 0)
+    BANANA_STUB_SCALE                      multiplies image dimensions, e.g. 0.25 for light runs
+                                           (default 1)
+"""
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# Pixel dimensions the image model returns per image_size and aspect ratio
+IMAGE_DIMENSIONS = {
+    "1K": {"16:9": (1376, 768), "4:3": (1200, 896), "1:1": (1024, 1024)},
+    "2K": {"16:9": (2752, 1536), "4:3": (2400, 1792), "1:1": (2048, 2048)},
+    "4K": {"16:9": (5504, 3072), "4:3": (4800, 3584), "1:1": (4096, 4096)},
+}
+
+DEFAULT_LATENCY = {"1K": 1.0, "2K": 2.0, "4K": 4.0, "text": 0.5}
+# Pieces a streamed text response arrives in
+STREAM_CHUNKS = 20
+
+
+class StubAPIError(Exception):
+    """Mimics google.genai.errors.APIError closely enough for the scheduler's retry logic"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+
+
+def _image_part(data):
+    return SimpleNamespace(inline_data=SimpleNamespace(data=data, mime_type="image/png"), text=None)
+
+
+def _response(parts=None, text=None):
+    content = SimpleNamespace(parts=parts or [SimpleNamespace(inline_data=None, text=text)])
+    return SimpleNamespace(candidates=[SimpleNamespace(content=content)], text=text)
+
+
+class StubModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        image_config = getattr(config, "image_config", None) if config is not None else None
+        if image_config is not None:
+            image_size = image_config.image_size or "1K"
+            self._client.wait(image_size)
+            data = self._client.image_bytes(image_size, image_config.aspect_ratio or "1:1")
+            return _response(parts=[_image_part(data)])
+
+        self._client.wait("text")
+        return _response(text=self._client.text(contents))
+
+    def generate_content_stream(self, model, contents, config=None):
+        """The text response in STREAM_CHUNKS pieces, spreading the text latency across them"""
+        text = self._client.text(contents)
+        size = -(-len(text) // STREAM_CHUNKS)
+        for start in range(0, len(text), size):
+            if start == 0:
+                self._client.wait("text", fraction=1 / STREAM_CHUNKS)
+            else:
+                self._client.pause("text", fraction=1 / STREAM_CHUNKS)
+            yield _response(text=text[start:start + size])
+
+
+class StubClient:
+    """Serves generated PNGs and JSON outlines after a configurable, jittered delay"""
+
+    def __init__(self, latency=None, jitter=0.2, error_rate=0.0, scale=1.0, seed=None):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.scale = scale
+        self.requests = 0
+        self.models = StubModels(self)
+        self._random = random.Random(seed)
+        self._images = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        env = os.environ
+        return cls(
+            latency={
+                "1K": float(env.get("BANANA_STUB_LATENCY_1K", DEFAULT_LATENCY["1K"])),
+                "2K": float(env.get("BANANA_STUB_LATENCY_2K", DEFAULT_LATENCY["2K"])),
+                "4K": float(env.get("BANANA_STUB_LATENCY_4K", DEFAULT_LATENCY["4K"])),
+                "text": float(env.get("BANANA_STUB_LATENCY_TEXT", DEFAULT_LATENCY["text"])),
+            },
+            jitter=float(env.get("BANANA_STUB_JITTER", "0.2")),
+            error_rate=float(env.get("BANANA_STUB_ERROR_RATE", "0")),
+            scale=float(env.get("BANANA_STUB_SCALE", "1")),
+        )
+
+    def wait(self, kind, fraction=1.0):
+        """Sleep for the configured latency of kind, then possibly fail like an overloaded server"""
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.error_rate
+        self.pause(kind, fraction)
+        if fail:
+            raise StubAPIError(503, "The model is overloaded. Please try again later.")
+
+    def pause(self, kind, fraction=1.0):
+        """Sleep for fraction of the configured latency of kind, e.g. between chunks of a stream"""
+        with self._lock:
+            jitter = 1 + self._random.uniform(-self.jitter, self.jitter)
+            delay = self.latency.get(kind, self.latency["4K"]) * fraction * jitter
+        time.sleep(max(0.0, delay))
+
+    def image_bytes(self, image_size, aspect_ratio):
+        """A PNG of the real model's dimensions, rendered once per size and reused"""
+        key = (image_size, aspect_ratio)
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = self._render(*self._dimensions(image_size, aspect_ratio))
+            return self._images[key]
+
+    def _dimensions(self, image_size, aspect_ratio):
+        width, height = IMAGE_DIMENSIONS.get(image_size, IMAGE_DIMENSIONS["1K"]).get(aspect_ratio, (1024, 1024))
+        return max(1, int(width * self.scale)), max(1, int(height * self.scale))
+
+    def _render(self, width, height):
+        from PIL import Image
+
+        # Noise over a gradient compresses about as poorly as real slide art, so byte sizes are realistic
+        noise = Image.effect_noise((width, height), 40).convert("RGB")
+        gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        img = Image.blend(gradient, noise, 0.35)
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+    def text(self, prompt):
+        """The text model's answer: a concept tree for the mind map tree prompt, otherwise a slide outline"""
+        if "mind map tree" in str(prompt):
+            return self.mindmap_tree_text(prompt)
+        return self.outline_text(prompt)
+
+    def outline_text(self, prompt):
+        """A JSON outline with as many slides as the outline prompt asks for"""
+        match = re.search(r"(\d+)-slide presentation", str(prompt))
+        num_slides = int(match.group(1)) if match else 3
+        return json.dumps([
+            {"title": f"Stub Slide {n}", "points": [f"Point {n}.1", f"Point {n}.2", f"Point {n}.3"]}
+            for n in range(1, num_slides + 1)
+        ])
+
+    def mindmap_tree_text(self, prompt):
+        """A JSON concept tree with the most main branches and sub-branches the tree prompt allows"""
+        match = re.search(r"(\d+)-(\d+) main branches, and (\d+)-(\d+) sub-branches", str(prompt))
+        branches, sub_branches = (int(match.group(2)), int(match.group(4))) if match else (5, 3)
+        return json.dumps({"title": "Stub Topic", "children": [
+            {"title": f"Stub Branch {n}", "children": [{"title": f"Idea {n}.{m}"} for m in range(1, sub_branches + 1)]}
+            for n in range(1, branches + 1)
+        ]})